@@ -5,211 +5,3685 @@ from PIL import Image
 import tempfile
 import os
 import io
+import hashlib
+import contextlib
+import functools
+import http.server
+import json
+import math
+import re
+import secrets
+import shutil
+import struct
+import subprocess
+import threading
+import queue
+import time
+import importlib
+import importlib.util
+import urllib.parse
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from fractions import Fraction
 
-def add_thumbnail_overlay(video_path, thumbnail_path, output_path, position='top-right', size_ratio=0.2, duration_frames=90):
+# ffmpeg encoders used to re-create a source stream when only part of it is re-encoded
+FFMPEG_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'mpeg4': 'mpeg4',
+    'vp9': 'libvpx-vp9',
+}
+
+# ffmpeg's profile names for H.264 mapped to libx264's -profile:v values
+H264_PROFILES = {
+    'Baseline': 'baseline',
+    'Constrained Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+def get_ffmpeg_path():
+    """Locate an ffmpeg binary (system install first, then the one bundled with imageio-ffmpeg)"""
+    path = shutil.which('ffmpeg')
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+def run_ffmpeg(args):
+    """Run ffmpeg with the given arguments and return whether it succeeded"""
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is None:
+        return False
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y'] + list(args),
+        capture_output=True
+    )
+    return result.returncode == 0
+
+def probe_video_stream(video_path):
+    """
+    Read the codec parameters of the first video stream from ffmpeg's stream summary
+    
+    Args:
+        video_path (str): Path to input video file
+    
+    Returns:
+        dict: codec, profile, pix_fmt, width, height, fps, timescale, sar, has_audio and
+        video_streams (not counting attached pictures), or None
+    """
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-i', video_path], capture_output=True, text=True)
+    except Exception:
+        return None
+    
+    line = re.search(r'Stream #.*?: Video: (.*)', result.stderr)
+    if not line:
+        return None
+    line = line.group(1)
+    
+    codec = re.match(r'(\w+)', line)
+    profile = re.match(r'\w+ \(([^/)]+)\)', line)
+    pix_fmt = re.search(r'\), (\w+)[(,]', line) or re.match(r'\w+, (\w+)[(,]', line)
+    size = re.search(r'(\d{2,5})x(\d{2,5})', line)
+    fps = re.search(r'([\d.]+) fps', line) or re.search(r'([\d.]+) tbr', line)
+    timescale = re.search(r'([\d.]+)(k?) tbn', line)
+    sar = re.search(r'SAR (\d+:\d+)', line)
+    
+    return {
+        'codec': codec.group(1) if codec else None,
+        'profile': profile.group(1) if profile else None,
+        'pix_fmt': pix_fmt.group(1) if pix_fmt else None,
+        'width': int(size.group(1)) if size else 0,
+        'height': int(size.group(2)) if size else 0,
+        'fps': float(fps.group(1)) if fps else 0,
+        'timescale': int(float(timescale.group(1)) * (1000 if timescale.group(2) else 1)) if timescale else None,
+        'sar': sar.group(1) if sar else None,
+        'has_audio': 'Audio:' in result.stderr,
+        'video_streams': sum(
+            1 for stream_line in result.stderr.splitlines()
+            if re.search(r'Stream #0:.*: Video:', stream_line) and '(attached pic)' not in stream_line
+        )
+    }
+
+def read_packet_index(video_path, max_packets=None):
+    """
+    List the packets of the first video stream without decoding them
+    
+    Args:
+        video_path (str): Path to input video file
+        max_packets (int): Stop after this many packets
+    
+    Returns:
+        dict: time_base (seconds per tick) plus pts and keyframe lists in decode order, or None
+    """
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', video_path,
+             '-map', '0:v:0', '-c', 'copy', *(['-frames:v', str(max_packets)] if max_packets else []),
+             '-f', 'framecrc', '-'],
+            capture_output=True, text=True
+        )
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+    
+    time_base = None
+    pts, keyframe = [], []
+    for line in result.stdout.splitlines():
+        if line.startswith('#tb 0:'):
+            time_base = float(Fraction(line.split(':', 1)[1].strip()))
+        elif line and not line.startswith('#'):
+            # stream, dts, pts, duration, size, crc[, F=flags] - flags are only
+            # printed when they differ from a plain keyframe
+            parts = [part.strip() for part in line.split(',')]
+            pts.append(int(parts[2]))
+            keyframe.append(len(parts) < 7 or bool(int(parts[6].split('=')[1], 16) & 1))
+    
+    if time_base is None or not pts:
+        return None
+    return {'time_base': time_base, 'pts': pts, 'keyframe': keyframe}
+
+def read_mp4_table(f, box, dtype, columns=1, header=8):
+    """Entries of an MP4 sample table box as a (count, columns) array of big-endian integers"""
+    payload_start, box_end = box
+    f.seek(payload_start + 4)
+    count = struct.unpack('>I', f.read(4))[0]
+    f.seek(payload_start + header)
+    itemsize = np.dtype(dtype).itemsize
+    data = np.frombuffer(f.read(count * columns * itemsize), dtype=dtype)
+    return data.reshape(count, columns).astype(np.int64)
+
+def parse_mp4_packet_index(video_path):
+    """
+    Build the packet index of the first video track from MP4/MOV sample tables
+    
+    Timestamps come from stts/ctts, keyframes from stss and byte offsets from
+    stsc, stsz and stco/co64, so nothing is decoded and only the first packet
+    is demuxed.
+    
+    Returns:
+        dict: time_base plus pts, keyframe and offset arrays in decode order, or None
+    """
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        moov = find_mp4_box(f, 0, file_size, [b'moov'])
+        if moov is None:
+            return None
+        
+        for box_type, start, end in read_mp4_boxes(f, *moov):
+            if box_type != b'trak':
+                continue
+            hdlr = find_mp4_box(f, start, end, [b'mdia', b'hdlr'])
+            f.seek(hdlr[0] + 8)
+            if f.read(4) == b'vide':
+                break
+        else:
+            return None
+        
+        stbl = find_mp4_box(f, start, end, [b'mdia', b'minf', b'stbl'])
+        boxes = {box_type: (box_start, box_end) for box_type, box_start, box_end in read_mp4_boxes(f, *stbl)}
+        if b'stts' not in boxes or b'stsz' not in boxes or b'stsc' not in boxes:
+            return None
+        
+        mdhd = find_mp4_box(f, start, end, [b'mdia', b'mdhd'])
+        f.seek(mdhd[0])
+        version = f.read(4)[0]
+        timescale = struct.unpack('>I', f.read(28)[16:20] if version == 1 else f.read(16)[8:12])[0]
+        
+        # Sample sizes: one constant size or a table
+        f.seek(boxes[b'stsz'][0] + 4)
+        sample_size, count = struct.unpack('>II', f.read(8))
+        if count == 0:
+            return None
+        sizes = (np.full(count, sample_size, dtype=np.int64) if sample_size
+                 else np.frombuffer(f.read(count * 4), dtype='>u4').astype(np.int64))
+        
+        stts = read_mp4_table(f, boxes[b'stts'], '>u4', 2)
+        dts = np.concatenate([[0], np.cumsum(np.repeat(stts[:, 1], stts[:, 0]))])[:count]
+        pts = dts.copy()
+        if b'ctts' in boxes:
+            f.seek(boxes[b'ctts'][0])
+            ctts = read_mp4_table(f, boxes[b'ctts'], '>i4' if f.read(1)[0] == 1 else '>u4', 2)
+            pts += np.repeat(ctts[:, 1], ctts[:, 0])[:count]
+        
+        keyframe = np.ones(count, dtype=bool)
+        if b'stss' in boxes:
+            keyframe[:] = False
+            keyframe[read_mp4_table(f, boxes[b'stss'], '>u4')[:, 0] - 1] = True
+        
+        chunk_offsets = (read_mp4_table(f, boxes[b'stco'], '>u4')[:, 0] if b'stco' in boxes
+                         else read_mp4_table(f, boxes[b'co64'], '>u8')[:, 0])
+        stsc = read_mp4_table(f, boxes[b'stsc'], '>u4', 3)
+        # Expand the runs of samples per chunk, then place each sample after the ones before it in its chunk
+        run_lengths = np.diff(np.append(stsc[:, 0], len(chunk_offsets) + 1))
+        samples_per_chunk = np.repeat(stsc[:, 1], run_lengths)
+        chunk_of_sample = np.repeat(np.arange(len(chunk_offsets)), samples_per_chunk)[:count]
+        before = np.cumsum(sizes) - sizes
+        first_in_chunk = (np.cumsum(samples_per_chunk) - samples_per_chunk)[chunk_of_sample]
+        offset = chunk_offsets[chunk_of_sample] + before - before[first_in_chunk]
+    
+    # Edit lists shift the timestamps ffmpeg reports in ways that depend on its
+    # demuxer, so anchor them to the first packet as ffmpeg sees it
+    first = read_packet_index(video_path, max_packets=1)
+    if first is not None:
+        pts += round(first['pts'][0] * first['time_base'] * timescale) - pts[0]
+    return {'time_base': 1 / timescale, 'pts': pts, 'keyframe': keyframe, 'offset': offset}
+
+def find_smart_render_split(video_path, duration_frames):
+    """
+    Find the first keyframe at or after the end of the overlay window
+    
+    Returns:
+        tuple: (frame_index, timestamp_sec) of the keyframe, or None if there is none
+    """
+    index = get_keyframe_index(video_path)
+    if index is None:
+        return None
+    
+    following = index['keyframes'][index['keyframes'] >= max(duration_frames, 1)]
+    if not len(following):
+        return None
+    return int(following[0]), float(index['timestamps'][following[0]])
+
+def matching_encoder_args(stream):
+    """ffmpeg output arguments that re-create the codec parameters of a probed stream"""
+    args = ['-c:v', FFMPEG_ENCODERS[stream['codec']]]
+    if stream['pix_fmt']:
+        args += ['-pix_fmt', stream['pix_fmt']]
+    if stream['codec'] == 'h264' and stream['profile'] in H264_PROFILES:
+        args += ['-profile:v', H264_PROFILES[stream['profile']]]
+    if stream['codec'] == 'mpeg4':
+        args += ['-q:v', '2']
+    if stream['sar'] and stream['sar'] != '1:1':
+        args += ['-vf', f"setsar={stream['sar'].replace(':', '/')}"]
+    if stream['timescale']:
+        args += ['-video_track_timescale', str(stream['timescale'])]
+    return args
+
+def can_match_stream(stream, width, height):
+    """Whether frames decoded at width x height can be encoded to join a probed stream"""
+    # OpenCV applies rotation metadata while decoding, in which case the
+    # decoded size no longer matches the stored stream
+    return (
+        stream is not None
+        and stream['codec'] in FFMPEG_ENCODERS
+        and (stream['width'], stream['height']) == (width, height)
+    )
+
+def open_ffmpeg_encoder(output_path, fps, width, height, codec_args):
+    """Start an ffmpeg process that encodes raw BGR frames written to its stdin"""
+    ffmpeg = get_ffmpeg_path()
+    rate = Fraction(fps).limit_denominator(1001)
+    return subprocess.Popen(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+         '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(rate), '-i', '-']
+        + codec_args + [output_path],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+# Disk cache of pre-encoded intro segments, keyed by content and encoding parameters
+CACHE_ROOT = os.path.join(tempfile.gettempdir(), 'video_thumbnail_creator')
+INTRO_CACHE_DIR = os.path.join(CACHE_ROOT, 'intros')
+INTRO_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_lookup(cache_dir, key, suffix='.mp4'):
+    """Path of a cached entry (marked as recently used), or None on a miss"""
+    path = os.path.join(cache_dir, key + suffix)
+    if not os.path.exists(path):
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+def cache_store(cache_dir, key, source_path, max_bytes, suffix='.mp4', in_use=()):
+    """
+    Move a file into a size-bounded cache directory, evicting least recently used entries
+    
+    Entries in in_use (e.g. other files of the same entry) are never evicted.
+    
+    Returns:
+        str: Path of the cached entry
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + suffix)
+    
+    # Move under a private name first so readers never see a partial entry
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.move(source_path, tmp_path)
+    os.replace(tmp_path, path)
+    
+    evict_cache(cache_dir, max_bytes, keep=path, in_use=in_use)
+    return path
+
+def evict_cache(cache_dir, max_bytes, keep=None, in_use=()):
+    """Delete least recently used entries until the directory fits in max_bytes, sparing keep and in_use"""
+    entries = []
+    in_use_bytes = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.tmp') or path == keep:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if path in in_use:
+            in_use_bytes += stat.st_size
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in entries) + in_use_bytes
+    if keep and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+# Uploads written to disk once per content, shared by every session and rerun
+UPLOAD_STORE_DIR = os.path.join(CACHE_ROOT, 'uploads')
+UPLOAD_STORE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def copy_upload(upload, path, chunk_size=UPLOAD_CHUNK_BYTES):
+    """
+    Copy an uploaded file to disk in fixed-size chunks, hashing it in the same pass
+    
+    Chunks are read into one reused buffer, so memory stays at chunk_size however
+    large the upload is (read() would copy the whole upload into a new bytes object).
+    
+    Returns:
+        str: SHA-256 hex digest of the contents
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    upload.seek(0)
+    with open(path, 'wb') as f:
+        while True:
+            size = upload.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+            f.write(view[:size])
+    upload.seek(0)
+    return digest.hexdigest()
+
+class UploadStore:
+    """
+    Content-addressed directory of uploaded files with reference counting
+    
+    Each distinct upload is written once and found again by its content hash, so
+    reruns and other sessions reuse the file. Least recently used entries are
+    evicted past max_bytes, except files a script run still holds.
+    """
+    
+    def __init__(self, store_dir=UPLOAD_STORE_DIR, max_bytes=UPLOAD_STORE_MAX_BYTES):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.refs = {}
+        # Streamlit gives every upload a file_id, so reruns skip hashing it again
+        self.hashes = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def acquire(self, upload):
+        """
+        Path and content hash of an upload, writing it to the store on a miss
+        
+        Returns:
+            tuple: (path, content_hash); the path stays on disk until release(path)
+        """
+        suffix = '.' + upload.name.rsplit('.', 1)[-1].lower()
+        with self.lock:
+            content_hash = self.hashes.get(upload.file_id)
+        path = self.pin(content_hash, suffix) if content_hash else None
+        
+        # Unseen uploads are copied and hashed in one pass, then moved to their content address
+        if path is None:
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_path = os.path.join(self.store_dir, f"upload.{os.getpid()}.{threading.get_ident()}.tmp")
+            content_hash = copy_upload(upload, tmp_path)
+            path = self.pin(content_hash, suffix, tmp_path)
+        
+        with self.lock:
+            self.hashes[upload.file_id] = content_hash
+            self.hashes.move_to_end(upload.file_id)
+            while len(self.hashes) > 1024:
+                self.hashes.popitem(last=False)
+        return path, content_hash
+    
+    def retain(self, path):
+        """Take another reference to a file already held, e.g. for a job that outlives the script run"""
+        with self.lock:
+            self.refs[path] += 1
+    
+    def known_hash(self, upload):
+        """Content hash of an upload this store has already seen, or None"""
+        with self.lock:
+            return self.hashes.get(upload.file_id)
+    
+    def pin(self, content_hash, suffix, source_path=None):
+        """Take a reference to a stored file, moving source_path into place first if given; None on a miss"""
+        path = os.path.join(self.store_dir, content_hash + suffix)
+        with self.lock:
+            if source_path is not None:
+                if os.path.exists(path):
+                    os.unlink(source_path)
+                else:
+                    os.replace(source_path, path)
+            elif cache_lookup(self.store_dir, content_hash, suffix) is None:
+                return None
+            self.refs[path] = self.refs.get(path, 0) + 1
+            if source_path is not None:
+                evict_cache(self.store_dir, self.max_bytes, keep=path, in_use=self.refs)
+        return path
+    
+    def release(self, path):
+        """Drop a reference taken by acquire; unreferenced files become evictable again"""
+        with self.lock:
+            self.refs[path] -= 1
+            if not self.refs[path]:
+                del self.refs[path]
+                evict_cache(self.store_dir, self.max_bytes, in_use=self.refs)
+
+@st.cache_resource
+def get_upload_store():
+    """The upload store shared by every session of this server process"""
+    return UploadStore(UPLOAD_STORE_DIR, UPLOAD_STORE_MAX_BYTES)
+
+@contextlib.contextmanager
+def stored_upload(upload):
+    """Hold an upload in the shared store for the block, yielding (path, content_hash)"""
+    store = get_upload_store()
+    path, content_hash = store.acquire(upload)
+    try:
+        yield path, content_hash
+    finally:
+        store.release(path)
+
+# Finished renders, served from disk instead of being held in memory for the download button
+OUTPUT_STORE_DIR = os.path.join(CACHE_ROOT, 'outputs')
+OUTPUT_STORE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Port of the download server (0 picks a free one) and, behind a reverse proxy, the public URL mapped to it
+DOWNLOAD_PORT = int(os.environ.get('DOWNLOAD_PORT', '0'))
+DOWNLOAD_BASE_URL = os.environ.get('DOWNLOAD_BASE_URL')
+
+def publish_output(output_path, suffix='.mp4'):
+    """
+    Move a finished render into the output store, where it outlives the script run
+    
+    Returns:
+        str: Key of the stored output, which also names it in download URLs
+    """
+    key = secrets.token_hex(16)
+    cache_store(OUTPUT_STORE_DIR, key, output_path, OUTPUT_STORE_MAX_BYTES, suffix=suffix)
+    return key
+
+def parse_byte_range(header, size):
+    """(start, end) of a single-range 'bytes=' Range header, None to send the whole file, or False if unsatisfiable"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+class DownloadHandler(http.server.BaseHTTPRequestHandler):
+    """GET/HEAD /<key>/<file name> for outputs in the store, with Range support for resumed and partial downloads"""
+    
+    def do_HEAD(self):
+        self.send_output(body=False)
+    
+    def do_GET(self):
+        self.send_output(body=True)
+    
+    def send_output(self, body):
+        parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/', 1)
+        key = parts[0]
+        path = cache_lookup(OUTPUT_STORE_DIR, key) if re.fullmatch(r'[0-9a-f]{32,64}', key) else None
+        if path is None:
+            self.send_error(404)
+            return
+        
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            etag = f'"{key}-{stat.st_size}"'
+            byte_range = parse_byte_range(self.headers.get('Range'), stat.st_size)
+            # A resumed download only gets a partial response if the file is still the one it started on
+            if self.headers.get('If-Range') not in (None, etag):
+                byte_range = None
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{stat.st_size}')
+                self.end_headers()
+                return
+            
+            start, end = byte_range or (0, stat.st_size - 1)
+            self.send_response(206 if byte_range else 200)
+            if byte_range:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+            file_name = urllib.parse.unquote(parts[1]) if len(parts) > 1 else os.path.basename(path)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{urllib.parse.quote(file_name)}")
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.end_headers()
+            if body and end >= start:
+                try:
+                    self.connection.sendfile(f, start, end - start + 1)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+    
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def get_download_server():
+    """The download server of this process, started on first use, or None if it can't listen"""
+    try:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', DOWNLOAD_PORT), DownloadHandler)
+    except OSError:
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def download_base_url():
+    """Base URL the browser reaches the download server at, or None to download through Streamlit instead"""
+    if DOWNLOAD_BASE_URL:
+        return DOWNLOAD_BASE_URL.rstrip('/')
+    # Without a proxy the server is only reachable when the browser runs on this machine
+    host = (st.context.headers.get('Host') or '').rsplit(':', 1)[0]
+    if host not in ('localhost', '127.0.0.1'):
+        return None
+    server = get_download_server()
+    if server is None:
+        return None
+    return f"http://{host}:{server.server_port}"
+
+def read_output(key, suffix='.mp4'):
+    """Contents of a stored output, for Streamlit's own download button"""
+    with open(os.path.join(OUTPUT_STORE_DIR, key + suffix), 'rb') as f:
+        return f.read()
+
+def download_output(key, label, file_name, button_key=None):
+    """
+    Download control for a stored output
+    
+    Links to the download server, which streams the file from disk and honours
+    Range requests; where the browser can't reach it, falls back to a download
+    button that reads the file only when clicked.
+    """
+    base_url = download_base_url()
+    if base_url:
+        st.link_button(label, f"{base_url}/{key}/{urllib.parse.quote(file_name)}")
+    else:
+        st.download_button(label=label, data=functools.partial(read_output, key), file_name=file_name,
+                           mime="video/mp4", key=button_key)
+
+def job_key(input_hashes, params):
+    """Registry key of a render: the content hashes of its inputs plus every parameter that changes the output"""
+    payload = json.dumps({'inputs': list(input_hashes), 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def get_job_registry():
+    """Finished renders of this session by job key, kept across reruns"""
+    return st.session_state.setdefault('job_registry', {})
+
+def find_finished_job(key):
+    """Result of a finished render whose outputs are all still stored, or None"""
+    registry = get_job_registry()
+    job = registry.get(key)
+    if job is None:
+        return None
+    if any(cache_lookup(OUTPUT_STORE_DIR, output['key']) is None for output in job['outputs']):
+        # Evicted from the output store; the next render replaces the entry
+        del registry[key]
+        return None
+    return job
+
+def register_finished_job(key, outputs, **details):
+    """
+    Publish a render's output files and record the result under its job key
+    
+    Args:
+        key (str): Job key from job_key
+        outputs (list): dicts with the output_path of each file to publish (or the key of
+            one already published) plus anything shown with it
+    
+    Returns:
+        dict: The registered job: details plus outputs, whose output_path is replaced by
+        the stored key and size
+    """
+    stored = []
+    for output in outputs:
+        output = dict(output)
+        if 'output_path' in output:
+            output['size'] = os.path.getsize(output['output_path'])
+            output['key'] = publish_output(output.pop('output_path'))
+        stored.append(output)
+    job = dict(details, outputs=stored)
+    get_job_registry()[key] = job
+    return job
+
+# Background renders, run on a pool owned by the server process rather than by a script run
+JOB_STATE_DIR = os.path.join(CACHE_ROOT, 'jobs')
+JOB_STATE_MAX_BYTES = 4 * 1024 * 1024
+JOB_WORKERS = 2
+
+class JobRunner:
+    """
+    Render jobs on a thread pool, independent of the script run that submitted them
+    
+    Every job gets an ID and a state dict (status, frames done, warnings, result or error)
+    that is also written to JOB_STATE_DIR as JSON, so pages poll it by ID and
+    reattach to it after a rerun or a reload.
+    """
+    
+    def __init__(self, workers=JOB_WORKERS, state_dir=JOB_STATE_DIR):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render-job')
+        self.state_dir = state_dir
+        self.jobs = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, func, *args, key=None, label='', total_frames=0, cleanup=(), **kwargs):
+        """
+        Queue func(*args, **kwargs) as a job
+        
+        Args:
+            key (str): Job key of the render (see job_key), so a duplicate submission can be spotted
+            label (str): Shown next to the job's progress
+            total_frames (int): Frames the render is expected to encode, 0 if unknown
+            cleanup (iterable): Callables run once the job has finished, e.g. to release its inputs
+        
+        Returns:
+            str: Job ID
+        """
+        job_id = secrets.token_hex(8)
+        state = {'id': job_id, 'key': key, 'label': label, 'status': 'queued', 'frames': 0,
+                 'total_frames': total_frames, 'submitted': time.time(), 'started': None, 'finished': None,
+                 'result': None, 'error': None, 'warnings': []}
+        with self.lock:
+            self.jobs[job_id] = state
+            self.save(state)
+        self.executor.submit(self.run, job_id, func, args, kwargs, list(cleanup))
+        return job_id
+    
+    def run(self, job_id, func, args, kwargs, cleanup):
+        """Run one job on a pool thread, recording its progress and outcome"""
+        self.update(job_id, status='running', started=time.time())
+        job_progress.callback = lambda frames: self.update(job_id, frames=frames, save=False)
+        job_progress.warn = lambda message: self.warn(job_id, message)
+        try:
+            result = func(*args, **kwargs)
+            self.update(job_id, status='done', result=result, finished=time.time())
+        except Exception as e:
+            self.update(job_id, status='failed', error=str(e) or type(e).__name__, finished=time.time())
+        finally:
+            job_progress.callback = None
+            job_progress.warn = None
+            for release in cleanup:
+                release()
+    
+    def update(self, job_id, save=True, **changes):
+        """Change a job's state, writing it to disk unless it's just a progress tick"""
+        with self.lock:
+            state = self.jobs[job_id]
+            state.update(changes)
+            if save:
+                self.save(state)
+    
+    def warn(self, job_id, message):
+        """Record a warning the job's render raised, e.g. that it fell back to a slower path"""
+        with self.lock:
+            state = self.jobs[job_id]
+            state['warnings'].append(message)
+            self.save(state)
+    
+    def save(self, state):
+        """Write a job's state to its JSON file"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, f"{state['id']}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+        evict_cache(self.state_dir, JOB_STATE_MAX_BYTES, keep=path)
+    
+    def get(self, job_id):
+        """
+        Current state of a job, or None if it is unknown
+        
+        Jobs from an earlier server process are read from disk; any that hadn't
+        finished were lost with that process and are reported as failed.
+        """
+        with self.lock:
+            state = self.jobs.get(job_id)
+            if state is not None:
+                return dict(state)
+        if not re.fullmatch(r'[0-9a-f]{16}', job_id):
+            return None
+        try:
+            with open(os.path.join(self.state_dir, f"{job_id}.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['status'] in ('queued', 'running'):
+            state.update(status='failed', error="Interrupted by a server restart")
+        return state
+    
+    def find(self, key):
+        """ID of a queued or running job for this job key, or None"""
+        with self.lock:
+            for state in self.jobs.values():
+                if state['key'] == key and state['status'] in ('queued', 'running'):
+                    return state['id']
+        return None
+
+@st.cache_resource
+def get_job_runner():
+    """The job runner shared by every session of this server process"""
+    return JobRunner(JOB_WORKERS, JOB_STATE_DIR)
+
+def render_thumbnail_job(video_path, thumbnail_path, params, options):
+    """
+    Render one video with a thumbnail on the job runner and publish the output
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        params (dict): mode ('intro', 'overlay' or 'cover') and its settings, as keyed by job_key
+        options (dict): file_name plus queue_depth, threads and segments, and duration_frames for overlays
+    
+    Returns:
+        dict: file_name, outputs (stored key and size) and pipeline stats, as kept in the job registry
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_output:
+        output_path = tmp_output.name
+    
+    stats = {}
+    try:
+        if params['mode'] == 'intro':
+            success = create_thumbnail_intro(video_path, thumbnail_path, output_path, params['intro_duration'],
+                                             params['stream_copy'], options['queue_depth'], options['threads'], stats,
+                                             options['segments'], params['encoder'])
+        elif params['mode'] == 'cover':
+            success = embed_thumbnail_cover(video_path, thumbnail_path, output_path)
+        else:
+            success = add_thumbnail_overlay(video_path, thumbnail_path, output_path, params['position'],
+                                            params['size'] / 100, options['duration_frames'], params['smart_render'],
+                                            options['queue_depth'], options['threads'], stats, options['segments'],
+                                            params['encoder'])
+    except Exception as e:
+        success = False
+        error = f"Error processing video: {e}"
+    else:
+        error = "Failed to process video. Please try a different video format."
+    
+    if not success or not os.path.exists(output_path) or not os.path.getsize(output_path):
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        raise RuntimeError(error)
+    
+    size = os.path.getsize(output_path)
+    return {'file_name': options['file_name'], 'outputs': [{'key': publish_output(output_path), 'size': size}],
+            'stats': stats}
+
+def expected_job_frames(video_path, params, options, content_hash=None):
+    """Frames render_thumbnail_job will encode on its own thread, for the progress bar; 0 if ffmpeg or worker processes do the work"""
+    info = get_video_info(video_path, content_hash)
+    if info is None or params['mode'] == 'cover':
+        return 0
+    if params['mode'] == 'intro':
+        if params['stream_copy'] or options['segments'] > 1:
+            return 0
+        return int(info['fps'] * params['intro_duration']) + info['total_frames']
+    if params['smart_render']:
+        split = find_smart_render_split(video_path, options['duration_frames'])
+        if split is not None:
+            return split[0]
+    return 0 if options['segments'] > 1 else info['total_frames']
+
+def session_job_ids():
+    """IDs of the render jobs started from this page, kept in the URL so a reload reattaches to them"""
+    if 'render_jobs' not in st.session_state:
+        st.session_state['render_jobs'] = [job_id for job_id in st.query_params.get('jobs', '').split(',') if job_id]
+    return st.session_state['render_jobs']
+
+def track_job(job_id):
+    """Remember a submitted job for this session and its URL"""
+    job_ids = session_job_ids()
+    job_ids.append(job_id)
+    st.query_params['jobs'] = ','.join(job_ids)
+
+def session_jobs():
+    """States of this session's render jobs; finished ones are added to the job registry"""
+    runner = get_job_runner()
+    registry = get_job_registry()
+    states = []
+    for job_id in session_job_ids():
+        state = runner.get(job_id)
+        if state is None:
+            continue
+        if state['status'] == 'done' and state['key'] not in registry:
+            registry[state['key']] = state['result']
+        states.append(state)
+    return states
+
+def render_jobs(current_key=None):
+    """This session's render jobs, polled every second while any are still queued or running"""
+    states = session_jobs()
+    if any(state['status'] in ('queued', 'running') for state in states):
+        poll_render_jobs(current_key)
+    else:
+        show_render_jobs(states, current_key)
+
+@st.fragment(run_every=1.0)
+def poll_render_jobs(current_key):
+    """Redraw job progress; once nothing is left running, rerun the page so finished results show where they belong"""
+    states = session_jobs()
+    show_render_jobs(states, current_key)
+    if not any(state['status'] in ('queued', 'running') for state in states):
+        st.rerun()
+
+def show_render_jobs(states, current_key):
+    """Progress of active jobs, their warnings, errors of failed ones and downloads of finished ones other than current_key"""
+    for state in states:
+        for message in state.get('warnings', []):
+            st.warning(f"{message} ({state['label']})")
+        if state['status'] == 'queued':
+            st.progress(0.0, text=f"⏳ {state['label']}: waiting for a free worker")
+        elif state['status'] == 'running':
+            elapsed = time.time() - state['started']
+            if state['total_frames']:
+                st.progress(min(state['frames'] / state['total_frames'], 1.0),
+                            text=f"🎬 {state['label']}: {state['frames']:,}/{state['total_frames']:,} frames · {elapsed:.0f}s")
+            else:
+                st.progress(0.0, text=f"🎬 {state['label']}: working · {elapsed:.0f}s")
+        elif state['status'] == 'failed':
+            st.error(f"❌ {state['label']}: {state['error']}")
+        elif state['key'] != current_key and cache_lookup(OUTPUT_STORE_DIR, state['result']['outputs'][0]['key']):
+            output = state['result']['outputs'][0]
+            download_output(output['key'], f"💾 {state['label']} ({output['size'] / (1024*1024):.2f} MB)",
+                            state['result']['file_name'], button_key=f"job_{state['id']}")
+
+# Encoder backends selectable per job (see open_video_writer)
+ENCODER_BACKENDS = {
+    'opencv': "OpenCV (MPEG-4 Part 2)",
+    'ffmpeg': "ffmpeg pipe (H.264, libx264)",
+    'pyav': "PyAV (H.264, libx264)",
+}
+
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+
+class FFmpegWriter:
+    """cv2.VideoWriter-style writer piping raw BGR frames into a local ffmpeg/libx264 process"""
+    
+    def __init__(self, output_path, fps, width, height, preset='medium', crf=23):
+        # yuv420p needs even dimensions, so pad odd ones by a pixel
+        self.process = open_ffmpeg_encoder(output_path, fps, width, height, [
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p', '-movflags', '+faststart'
+        ])
+    
+    def write(self, frame):
+        self.process.stdin.write(frame.data)
+    
+    def release(self):
+        if not self.process.stdin.closed:
+            self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError("ffmpeg failed to encode the video")
+
+class PyAVWriter:
+    """cv2.VideoWriter-style writer encoding through PyAV's libx264 bindings"""
+    
+    def __init__(self, output_path, fps, width, height, preset='medium', crf=23):
+        import av
+        self.container = av.open(output_path, mode='w')
+        self.stream = self.container.add_stream('libx264', rate=Fraction(fps).limit_denominator(1001))
+        self.stream.width = width - width % 2
+        self.stream.height = height - height % 2
+        self.stream.pix_fmt = 'yuv420p'
+        self.stream.options = {'preset': preset, 'crf': str(crf)}
+        self.av = av
+    
+    def write(self, frame):
+        # yuv420p needs even dimensions, so odd ones lose their last row/column
+        frame = frame[:self.stream.height, :self.stream.width]
+        video_frame = self.av.VideoFrame.from_ndarray(frame, format='bgr24')
+        for packet in self.stream.encode(video_frame):
+            self.container.mux(packet)
+    
+    def release(self):
+        if self.container is None:
+            return
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        self.container = None
+
+def available_encoders():
+    """Encoder backends usable in this environment"""
+    backends = ['opencv']
+    if get_ffmpeg_path():
+        backends.append('ffmpeg')
+    # Only look the package up; PyAVWriter imports it when a job actually uses it
+    if importlib.util.find_spec('av') is not None:
+        backends.append('pyav')
+    return backends
+
+def open_video_writer(output_path, fps, width, height, encoder=None):
+    """
+    Open a video writer for the chosen encoder backend
+    
+    Args:
+        output_path (str): Path for output video file
+        fps (float): Frame rate
+        width (int): Frame width
+        height (int): Frame height
+        encoder (dict): backend ('opencv', 'ffmpeg' or 'pyav') plus preset and crf
+            for the H.264 backends; defaults to OpenCV's MPEG-4 writer
+    
+    Returns:
+        Writer with write(frame) and release() methods
+    """
+    options = dict(encoder or {})
+    backend = options.pop('backend', 'opencv')
+    if backend == 'ffmpeg':
+        return FFmpegWriter(output_path, fps, width, height, **options)
+    if backend == 'pyav':
+        return PyAVWriter(output_path, fps, width, height, **options)
+    
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+# Fixed-point scale of overlay alpha values (8 fractional bits)
+ALPHA_SHIFT = 8
+ALPHA_ONE = 1 << ALPHA_SHIFT
+
+def load_thumbnail(thumbnail_path, keep_alpha=False):
+    """Load a thumbnail as a BGR (or BGRA) image, falling back to PIL for formats OpenCV can't read"""
+    thumbnail = cv2.imread(thumbnail_path, cv2.IMREAD_UNCHANGED)
+    if thumbnail is None:
+        # Try loading with PIL and convert
+        pil_img = Image.open(thumbnail_path).convert('RGBA')
+        thumbnail = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGBA2BGRA)
+    
+    # Normalise 16-bit, grayscale and alpha-less images to 8-bit BGRA
+    if thumbnail.dtype != np.uint8:
+        thumbnail = (thumbnail // 257).astype(np.uint8)
+    if thumbnail.ndim == 2:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_GRAY2BGRA)
+    elif thumbnail.shape[2] == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2BGRA)
+    
+    if keep_alpha:
+        return thumbnail
+    return cv2.cvtColor(thumbnail, cv2.COLOR_BGRA2BGR)
+
+def build_overlay(thumbnail, opacity=0.8):
+    """
+    Precompute the premultiplied overlay and inverse-alpha mask used by blend_overlay
+    
+    Args:
+        thumbnail (ndarray): Resized BGRA thumbnail
+        opacity (float): Opacity applied on top of the thumbnail's own alpha
+    
+    Returns:
+        dict: premultiplied and inverse_alpha uint16 planes plus per-thread scratch space
+    """
+    alpha = np.rint(thumbnail[:, :, 3:].astype(np.float32) * (opacity * ALPHA_ONE / 255)).astype(np.uint16)
+    alpha = np.repeat(alpha, 3, axis=2)
+    
+    # Rounding is folded into the premultiplied plane; the largest possible
+    # sum, 255 * ALPHA_ONE + ALPHA_ONE / 2, still fits in 16 bits
+    premultiplied = thumbnail[:, :, :3].astype(np.uint16) * alpha + ALPHA_ONE // 2
+    
+    return {
+        'premultiplied': premultiplied,
+        'inverse_alpha': ALPHA_ONE - alpha,
+        'scratch': threading.local()
+    }
+
+def prepare_overlay_thumbnail(thumbnail_path, width, height, position='top-right', size_ratio=0.2, opacity=0.8):
+    """
+    Load and resize a thumbnail for overlaying and work out where it goes
+    
+    Returns:
+        tuple: (overlay, x, y) where overlay is the result of build_overlay
+    """
+    thumbnail = load_thumbnail(thumbnail_path, keep_alpha=True)
+    
+    # Calculate thumbnail size
+    thumb_width = int(width * size_ratio)
+    thumb_height = int(thumb_width * thumbnail.shape[0] / thumbnail.shape[1])
+    thumbnail = cv2.resize(thumbnail, (thumb_width, thumb_height))
+    
+    # Calculate position
+    if position == 'top-right':
+        x, y = width - thumb_width - 20, 20
+    elif position == 'top-left':
+        x, y = 20, 20
+    elif position == 'bottom-right':
+        x, y = width - thumb_width - 20, height - thumb_height - 20
+    elif position == 'bottom-left':
+        x, y = 20, height - thumb_height - 20
+    else:  # center
+        x, y = (width - thumb_width) // 2, (height - thumb_height) // 2
+    
+    # Ensure coordinates are valid
+    x = max(0, min(x, width - thumb_width))
+    y = max(0, min(y, height - thumb_height))
+    
+    return build_overlay(thumbnail, opacity), x, y
+
+def blend_overlay(frame, overlay, x, y):
+    """Blend a prepared overlay into frame at (x, y) in place, using fixed-point arithmetic"""
+    premultiplied = overlay['premultiplied']
+    thumb_height, thumb_width = premultiplied.shape[:2]
+    roi = frame[y:y+thumb_height, x:x+thumb_width]
+    
+    # Each compositor thread keeps its own 16-bit working buffer
+    scratch = getattr(overlay['scratch'], 'buffer', None)
+    if scratch is None:
+        scratch = overlay['scratch'].buffer = np.empty(premultiplied.shape, np.uint16)
+    
+    # roi * (1 - alpha) + thumbnail * alpha, rounded, in 8.8 fixed point
+    np.copyto(scratch, roi)
+    np.multiply(scratch, overlay['inverse_alpha'], out=scratch)
+    np.add(scratch, premultiplied, out=scratch)
+    np.right_shift(scratch, ALPHA_SHIFT, out=scratch)
+    np.copyto(roi, scratch, casting='unsafe')
+    
+    return frame
+
+# Marks the end of the frame stream between pipeline stages
+PIPELINE_END = None
+
+def put_until_stopped(q, item, stop):
+    """Put item on q unless stop is set first, returning the time spent blocked on a full queue"""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            continue
+    return time.perf_counter() - start
+
+def get_until_stopped(q, stop):
+    """Take the next item from q, returning it with the time spent blocked on an empty queue"""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1), time.perf_counter() - start
+        except queue.Empty:
+            continue
+    return PIPELINE_END, time.perf_counter() - start
+
+# Progress and warning callbacks of the background job running on this thread (see JobRunner)
+job_progress = threading.local()
+
+def report_progress(frames):
+    """Tell the background job running on this thread, if any, how many frames it has encoded"""
+    callback = getattr(job_progress, 'callback', None)
+    if callback is not None:
+        callback(frames)
+
+def render_warning(warnings, message):
+    """
+    Pass on a render's fallback notice
+    
+    It's collected in warnings when given, recorded by the background job running
+    on this thread if any (a pool thread can't draw on the page), else shown with st.warning.
+    """
+    callback = getattr(job_progress, 'warn', None)
+    if warnings is not None:
+        warnings.append(message)
+    elif callback is not None:
+        callback(message)
+    else:
+        st.warning(message)
+
+def run_frame_pipeline(read_frame, compose_frame, write_frame, queue_depth=8, threads=2, release_frame=None):
+    """
+    Run decode → composite → encode as concurrent stages joined by bounded queues
+    
+    Decoding and compositing run on their own threads while encoding runs on
+    the calling thread. OpenCV releases the GIL while decoding, blending and
+    encoding, so the stages overlap. Frames are written in their original order.
+    
+    Args:
+        read_frame (callable): Returns the next frame, or None at the end of the input
+        compose_frame (callable): compose_frame(index, frame) returns the frame to encode
+        write_frame (callable): Encodes one frame
+        queue_depth (int): Maximum number of frames waiting between two stages
+        threads (int): Number of compositor threads
+        release_frame (callable): Called with each frame once it has been encoded,
+            so its buffer can be reused (see allocate_frame_pool)
+    
+    Returns:
+        dict: Frame count plus busy and stall seconds for each stage
+    """
+    decoded = queue.Queue(maxsize=queue_depth)
+    composed = queue.Queue(maxsize=queue_depth)
+    stats = {stage: {'busy': 0.0, 'stall': 0.0} for stage in ('decode', 'composite', 'encode')}
+    stats_lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+    
+    def record(stage, busy, stall):
+        with stats_lock:
+            stats[stage]['busy'] += busy
+            stats[stage]['stall'] += stall
+    
+    def put(q, item):
+        return put_until_stopped(q, item, stop)
+    
+    def get(q):
+        return get_until_stopped(q, stop)
+    
+    def decode():
+        busy = stall = 0.0
+        index = 0
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                frame = read_frame()
+                busy += time.perf_counter() - start
+                if frame is None:
+                    break
+                stall += put(decoded, (index, frame))
+                index += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for _ in range(threads):
+                stall += put(decoded, PIPELINE_END)
+            record('decode', busy, stall)
+    
+    def composite():
+        busy = stall = 0.0
+        try:
+            while True:
+                item, waited = get(decoded)
+                stall += waited
+                if item is PIPELINE_END:
+                    break
+                index, frame = item
+                start = time.perf_counter()
+                frame = compose_frame(index, frame)
+                busy += time.perf_counter() - start
+                stall += put(composed, (index, frame))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stall += put(composed, PIPELINE_END)
+            record('composite', busy, stall)
+    
+    workers = [threading.Thread(target=decode, daemon=True)]
+    workers += [threading.Thread(target=composite, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    
+    # Encode on this thread, restoring frame order across compositor threads
+    busy = stall = 0.0
+    pending = {}
+    next_index = 0
+    finished = 0
+    try:
+        while finished < threads and not stop.is_set():
+            item, waited = get(composed)
+            stall += waited
+            if item is PIPELINE_END:
+                finished += 1
+                continue
+            pending[item[0]] = item[1]
+            while next_index in pending:
+                frame = pending.pop(next_index)
+                start = time.perf_counter()
+                write_frame(frame)
+                busy += time.perf_counter() - start
+                if release_frame is not None:
+                    release_frame(frame)
+                next_index += 1
+                report_progress(next_index)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        record('encode', busy, stall)
+        for worker in workers:
+            worker.join()
+    
+    if errors:
+        raise errors[0]
+    
+    stats['frames'] = next_index
+    return stats
+
+def run_fanout_pipeline(read_frame, branches, queue_depth=8, release_frame=None):
+    """
+    Decode once and feed every frame to several compositor+encoder branches
+    
+    Decoding runs on the calling thread and each branch on its own thread
+    behind a bounded queue. Frames are shared between branches, so a branch's
+    compose function must not modify the frame it is given.
+    
+    Args:
+        read_frame (callable): Returns the next frame, or None at the end of the input
+        branches (list): Dicts with 'compose' and 'write' callables (as for
+            run_frame_pipeline) and an optional 'start' run before the first frame
+        queue_depth (int): Maximum number of frames waiting for each branch
+        release_frame (callable): Called with each frame once every branch has encoded it
+    
+    Returns:
+        dict: Frame count plus busy and stall seconds for decoding and for each branch
+    """
+    inboxes = [queue.Queue(maxsize=queue_depth) for _ in branches]
+    stats = {
+        'decode': {'busy': 0.0, 'stall': 0.0},
+        'branches': [{'busy': 0.0, 'stall': 0.0} for _ in branches]
+    }
+    stop = threading.Event()
+    errors = []
+    
+    # Branches still to encode each frame, so shared buffers are released once
+    remaining = {}
+    remaining_lock = threading.Lock()
+    
+    def run_branch(k, branch):
+        busy = stall = 0.0
+        try:
+            if branch.get('start'):
+                branch['start']()
+            while True:
+                item, waited = get_until_stopped(inboxes[k], stop)
+                stall += waited
+                if item is PIPELINE_END:
+                    break
+                index, frame = item
+                start = time.perf_counter()
+                branch['write'](branch['compose'](index, frame))
+                busy += time.perf_counter() - start
+                with remaining_lock:
+                    remaining[index] -= 1
+                    done = remaining[index] == 0
+                    if done:
+                        del remaining[index]
+                if done and release_frame is not None:
+                    release_frame(frame)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stats['branches'][k] = {'busy': busy, 'stall': stall}
+    
+    workers = [threading.Thread(target=run_branch, args=(k, branch), daemon=True) for k, branch in enumerate(branches)]
+    for worker in workers:
+        worker.start()
+    
+    busy = stall = 0.0
+    index = 0
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            frame = read_frame()
+            busy += time.perf_counter() - start
+            if frame is None:
+                break
+            with remaining_lock:
+                remaining[index] = len(branches)
+            for inbox in inboxes:
+                stall += put_until_stopped(inbox, (index, frame), stop)
+            index += 1
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for inbox in inboxes:
+            stall += put_until_stopped(inbox, PIPELINE_END, stop)
+        for worker in workers:
+            worker.join()
+        stats['decode'] = {'busy': busy, 'stall': stall}
+    
+    if errors:
+        raise errors[0]
+    
+    stats['frames'] = index
+    return stats
+
+def allocate_frame_pool(width, height, queue_depth=8, threads=2):
+    """
+    Preallocate the BGR frame buffers a pipeline decodes into
+    
+    The pool holds one more buffer than the pipeline can have in flight (both
+    queues full, every compositor busy, frames waiting to be put back in order,
+    plus the decoder and encoder each holding one), so the decoder never waits
+    on a buffer that can't come back.
+    
+    Returns:
+        queue.Queue: Free buffers; capture_reader takes them and release_frame returns them
+    """
+    pool = queue.Queue()
+    for _ in range(2 * queue_depth + 2 * threads + 3):
+        pool.put(np.empty((height, width, 3), np.uint8))
+    return pool
+
+def capture_reader(cap, max_frames=None, pool=None):
+    """Frame source for run_frame_pipeline reading up to max_frames from an open VideoCapture"""
+    remaining = [max_frames]
+    
+    def read_frame():
+        if remaining[0] is not None:
+            if remaining[0] <= 0:
+                return None
+            remaining[0] -= 1
+        if pool is None:
+            ret, frame = cap.read()
+        else:
+            # Decode straight into a recycled buffer instead of a fresh array
+            buffer = pool.get()
+            ret, frame = cap.read(image=buffer)
+            if not ret:
+                pool.put(buffer)
+        return frame if ret else None
+    
+    return read_frame
+
+def concat_streams(part_paths, output_path, stream=None, audio_path=None, audio_offset=0, inpoints=None):
+    """
+    Join video parts with matching codec parameters into one MP4 without re-encoding
+    
+    Args:
+        part_paths (list): Paths of the parts, in playback order
+        output_path (str): Path for output video file
+        stream (dict): Optional probed parameters of the source stream (see probe_video_stream)
+        audio_path (str): Optional file whose audio track is copied alongside
+        audio_offset (float): Delay in seconds applied to the copied audio
+        inpoints (list): Optional timestamp (seconds, in the part's own timeline) each part starts
+            at, or None to use it from the beginning; should be a keyframe since nothing is decoded
+    
+    Returns:
+        bool: Success status
+    """
+    list_path = output_path + '.concat.txt'
+    with open(list_path, 'w') as f:
+        for path, inpoint in zip(part_paths, inpoints or [None] * len(part_paths)):
+            f.write(f"file '{os.path.abspath(path)}'\n")
+            if inpoint is not None:
+                f.write(f"inpoint {inpoint:.6f}\n")
+    
+    args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        if audio_offset:
+            args += ['-itsoffset', f'{audio_offset:.6f}']
+        args += ['-i', audio_path, '-map', '0:v', '-map', '1:a?']
+    args += ['-c', 'copy', '-movflags', '+faststart']
+    if stream and stream['timescale']:
+        args += ['-video_track_timescale', str(stream['timescale'])]
+    
+    try:
+        return run_ffmpeg(args + [output_path])
+    finally:
+        os.unlink(list_path)
+
+def joined_stream_matches(output_path, packets, span, fps):
+    """
+    Whether a concat join has the expected video packets: that many, with strictly
+    increasing timestamps spanning span seconds from first to last (within half a frame)
+    
+    The concat demuxer neither rescales nor checks timestamps between parts, so a
+    timescale mismatch or a misplaced inpoint only shows up in the joined output.
+    """
+    index = build_packet_index(output_path)
+    if index is None or len(index['pts']) != packets:
+        return False
+    pts = np.sort(index['pts'])
+    if not np.all(np.diff(pts) > 0):
+        return False
+    return abs((pts[-1] - pts[0]) * index['time_base'] - span) <= 0.5 / fps
+
+def packet_span(index):
+    """Seconds from the first to the last presentation timestamp of a packet index"""
+    return float(index['pts'].max() - index['pts'].min()) * index['time_base']
+
+def smart_render_overlay(video_path, thumbnail_path, output_path, position='top-right', size_ratio=0.2, duration_frames=90,
+                         queue_depth=8, threads=2, stats=None):
+    """
+    Add thumbnail overlay re-encoding only the GOPs the overlay touches
+    
+    Frames up to the first keyframe after the overlay window are re-encoded with
+    codec parameters matching the source, the rest of the original bitstream is
+    stream-copied, and the two parts are joined with ffmpeg's concat demuxer.
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+        position (str): Position of thumbnail overlay
+        size_ratio (float): Size of thumbnail relative to video
+        duration_frames (int): How many frames to show thumbnail
+        queue_depth (int): Frames buffered between pipeline stages
+        threads (int): Number of compositor threads
+        stats (dict): Filled with per-stage pipeline timings when given
+    
+    Returns:
+        bool: Success status (False if the video can't be split this way)
+    """
+    split = find_smart_render_split(video_path, duration_frames)
+    if split is None:
+        return False
+    split_frame, split_time = split
+    
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+    
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    stream = probe_video_stream(video_path)
+    if not can_match_stream(stream, width, height):
+        cap.release()
+        return False
+    
+    overlay, x, y = prepare_overlay_thumbnail(thumbnail_path, width, height, position, size_ratio)
+    
+    work_dir = tempfile.mkdtemp()
+    head_path = os.path.join(work_dir, 'head.mp4')
+    tail_path = os.path.join(work_dir, 'tail.mp4')
+    
+    try:
+        # Re-encode everything up to the split keyframe
+        encoder = open_ffmpeg_encoder(head_path, fps, width, height, matching_encoder_args(stream))
+        
+        def compose_frame(index, frame):
+            if index < duration_frames:
+                return blend_overlay(frame, overlay, x, y)
+            return frame
+        
+        pool = allocate_frame_pool(width, height, queue_depth, threads)
+        try:
+            pipeline_stats = run_frame_pipeline(
+                capture_reader(cap, split_frame, pool), compose_frame,
+                lambda frame: encoder.stdin.write(frame.data), queue_depth, threads, pool.put
+            )
+        finally:
+            encoder.stdin.close()
+        if stats is not None:
+            stats.update(pipeline_stats)
+        if encoder.wait() != 0:
+            return False
+        
+        # Copy the video stream untouched; the concat list starts it exactly at the split
+        # keyframe, so the tail's first frame follows the head's last one without a gap or overlap.
+        # Both parts need the same timescale, since the concat demuxer doesn't rescale between files
+        timescale_args = ['-video_track_timescale', str(stream['timescale'])] if stream['timescale'] else []
+        if not run_ffmpeg(['-i', video_path, '-map', '0:v:0', '-c', 'copy', *timescale_args, tail_path]):
+            return False
+        tail_index = build_packet_index(tail_path)
+        if tail_index is None or len(tail_index['pts']) <= split_frame:
+            return False
+        inpoint = np.sort(tail_index['pts'])[split_frame] * tail_index['time_base']
+        
+        # Join both parts and carry over the original audio, which is unaffected
+        if not concat_streams([head_path, tail_path], output_path, stream, audio_path=video_path,
+                              inpoints=[None, inpoint]):
+            return False
+        
+        # The demuxer seeks on raw sample times, so an edit list on the tail (e.g. a source with a
+        # nonzero start time) can land the inpoint a GOP early; only keep joins that line up exactly
+        return joined_stream_matches(output_path, len(tail_index['pts']), packet_span(tail_index), fps)
+    
+    finally:
+        cap.release()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def add_thumbnail_overlay(video_path, thumbnail_path, output_path, position='top-right', size_ratio=0.2, duration_frames=90, smart_render=False,
+                          queue_depth=8, threads=2, stats=None, parallel_segments=1, encoder=None, warnings=None):
+    """
+    Add thumbnail as an overlay on the video using OpenCV
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+        position (str): Position of thumbnail overlay
+        size_ratio (float): Size of thumbnail relative to video
+        duration_frames (int): How many frames to show thumbnail
+        smart_render (bool): Only re-encode the GOPs the overlay touches
+        queue_depth (int): Frames buffered between pipeline stages
+        threads (int): Number of compositor threads
+        stats (dict): Filled with per-stage pipeline timings when given
+        parallel_segments (int): Render this many keyframe-aligned segments in worker processes
+        encoder (dict): Encoder backend settings for full re-encodes (see open_video_writer)
+        warnings (list): Filled with fallback notices when given (see render_warning)
+    
+    Returns:
+        bool: Success status (errors are raised, so a background job can report them)
+    """
+    if smart_render:
+        if smart_render_overlay(video_path, thumbnail_path, output_path, position, size_ratio, duration_frames,
+                                queue_depth, threads, stats):
+            return True
+        render_warning(warnings, "⚠️ Smart render isn't possible for this video, falling back to a full re-encode")
+    
+    if parallel_segments > 1:
+        options = {'position': position, 'size_ratio': size_ratio, 'duration_frames': duration_frames,
+                   'queue_depth': queue_depth, 'threads': threads, 'encoder': encoder}
+        if render_in_segments('overlay', video_path, thumbnail_path, output_path, parallel_segments, options):
+            return True
+        render_warning(warnings, "⚠️ Couldn't split this video into segments, rendering it in one piece")
+    
+    # Open video
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+    
+    # Get video properties
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    
+    # Load, resize and position thumbnail
+    overlay, x, y = prepare_overlay_thumbnail(thumbnail_path, width, height, position, size_ratio)
+    
+    # Set up video writer
+    out = open_video_writer(output_path, fps, width, height, encoder)
+    
+    def compose_frame(index, frame):
+        # Add thumbnail overlay for the specified duration
+        if index < duration_frames:
+            return blend_overlay(frame, overlay, x, y)
+        return frame
+    
+    # Process each frame, decoding into a fixed set of reused buffers
+    pool = allocate_frame_pool(width, height, queue_depth, threads)
+    try:
+        pipeline_stats = run_frame_pipeline(
+            capture_reader(cap, pool=pool), compose_frame, out.write, queue_depth, threads, pool.put
+        )
+    finally:
+        # Release everything
+        cap.release()
+        out.release()
+    
+    if stats is not None:
+        stats.update(pipeline_stats)
+    
+    return True
+
+def concat_thumbnail_intro(video_path, thumbnail_path, output_path, intro_duration_sec=3):
+    """
+    Create a video with thumbnail intro encoding only the intro
+    
+    The still intro is encoded once with codec parameters matching the source
+    and joined to the untouched original stream with ffmpeg's concat demuxer.
+    Encoded intros are cached on disk, so a repeat build is a lookup plus a remux.
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+        intro_duration_sec (int): Duration of intro in seconds
+    
+    Returns:
+        bool: Success status (False if the source parameters can't be matched)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+    
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    
+    stream = probe_video_stream(video_path)
+    if fps <= 0 or not can_match_stream(stream, width, height):
+        return False
+    
+    codec_args = matching_encoder_args(stream)
+    intro_frames = int(fps * intro_duration_sec)
+    
+    # The same thumbnail encoded the same way gives the same intro, so reuse it
+    cache_key = hashlib.sha256(repr((
+        hash_file(thumbnail_path), width, height, round(fps, 6), intro_duration_sec, codec_args
+    )).encode()).hexdigest()
+    
+    work_dir = tempfile.mkdtemp()
+    body_path = os.path.join(work_dir, 'body.mp4')
+    
+    try:
+        intro_path = cache_lookup(INTRO_CACHE_DIR, cache_key)
+        if intro_path is None:
+            # Encode the still intro once
+            thumbnail = cv2.resize(load_thumbnail(thumbnail_path), (width, height))
+            encoded_path = os.path.join(work_dir, 'intro.mp4')
+            encoder = open_ffmpeg_encoder(encoded_path, fps, width, height, codec_args)
+            frame_bytes = thumbnail.tobytes()
+            for _ in range(intro_frames):
+                encoder.stdin.write(frame_bytes)
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                return False
+            intro_path = cache_store(INTRO_CACHE_DIR, cache_key, encoded_path, INTRO_CACHE_MAX_BYTES)
+        
+        # Copy the original video stream as-is, at the intro's timescale since the concat
+        # demuxer doesn't rescale between files
+        timescale_args = ['-video_track_timescale', str(stream['timescale'])] if stream['timescale'] else []
+        if not run_ffmpeg(['-i', video_path, '-map', '0:v:0', '-c', 'copy', *timescale_args, body_path]):
+            return False
+        body_index = build_packet_index(body_path)
+        if body_index is None or not len(body_index['pts']):
+            return False
+        
+        # Join them, shifting the original audio to start after the intro's last frame
+        if not concat_streams([intro_path, body_path], output_path, stream,
+                              audio_path=video_path, audio_offset=intro_frames / fps):
+            return False
+        
+        # Keep the join only if the body follows the intro at its original pace
+        return joined_stream_matches(output_path, intro_frames + len(body_index['pts']),
+                                     intro_frames / fps + packet_span(body_index), fps)
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def create_thumbnail_intro(video_path, thumbnail_path, output_path, intro_duration_sec=3, stream_copy=False,
+                           queue_depth=8, threads=2, stats=None, parallel_segments=1, encoder=None, warnings=None):
+    """
+    Create a video with thumbnail intro using OpenCV
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+        intro_duration_sec (int): Duration of intro in seconds
+        stream_copy (bool): Encode only the intro and copy the original stream
+        queue_depth (int): Frames buffered between pipeline stages
+        threads (int): Number of compositor threads
+        stats (dict): Filled with per-stage pipeline timings when given
+        parallel_segments (int): Render this many keyframe-aligned segments in worker processes
+        encoder (dict): Encoder backend settings for full re-encodes (see open_video_writer)
+        warnings (list): Filled with fallback notices when given (see render_warning)
+    
+    Returns:
+        bool: Success status (errors are raised, so a background job can report them)
+    """
+    if stream_copy:
+        if concat_thumbnail_intro(video_path, thumbnail_path, output_path, intro_duration_sec):
+            return True
+        render_warning(warnings, "⚠️ Couldn't match this video's codec parameters, falling back to a full re-encode")
+    
+    if parallel_segments > 1:
+        options = {'intro_duration_sec': intro_duration_sec, 'queue_depth': queue_depth, 'threads': threads,
+                   'encoder': encoder}
+        if render_in_segments('intro', video_path, thumbnail_path, output_path, parallel_segments, options):
+            return True
+        render_warning(warnings, "⚠️ Couldn't split this video into segments, rendering it in one piece")
+    
+    # Open video to get properties
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+    
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    # Load thumbnail
+    thumbnail = load_thumbnail(thumbnail_path)
+    
+    # Resize thumbnail to match video dimensions
+    thumbnail = cv2.resize(thumbnail, (width, height))
+    
+    # Set up video writer
+    out = open_video_writer(output_path, fps, width, height, encoder)
+    
+    intro_remaining = [int(fps * intro_duration_sec)]
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Reset to beginning
+    pool = allocate_frame_pool(width, height, queue_depth, threads)
+    read_video = capture_reader(cap, pool=pool)
+    
+    def read_frame():
+        # Intro frames (thumbnail) first, then the original video frames
+        if intro_remaining[0] > 0:
+            intro_remaining[0] -= 1
+            return thumbnail
+        return read_video()
+    
+    def release_frame(frame):
+        # The shared intro frame isn't one of the pool's buffers
+        if frame is not thumbnail:
+            pool.put(frame)
+    
+    try:
+        pipeline_stats = run_frame_pipeline(
+            read_frame, lambda index, frame: frame, out.write, queue_depth, threads, release_frame
+        )
+    finally:
+        # Release everything
+        cap.release()
+        out.release()
+    
+    if stats is not None:
+        stats.update(pipeline_stats)
+    
+    return True
+
+def worker_module():
+    """
+    This module imported under its own name, for functions sent to worker processes
+    
+    Streamlit runs this file as __main__, which worker processes can't import
+    functions from, so they're handed over through the module's real name.
+    """
+    return importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+
+def split_at_keyframes(video_path, segments, work_dir):
+    """
+    Cut the video stream into roughly equal parts at keyframes without re-encoding
+    
+    Args:
+        video_path (str): Path to input video file
+        segments (int): Number of parts wanted
+        work_dir (str): Directory the parts are written to
+    
+    Returns:
+        list: (segment_path, first_frame_index) tuples in playback order, or None
+    """
+    index = get_keyframe_index(video_path)
+    if index is None:
+        return None
+    
+    keyframes = [
+        (int(frame_index), float(index['timestamps'][frame_index]))
+        for frame_index in index['keyframes']
+        if frame_index > 0
+    ]
+    
+    # Cut at the first keyframe at or after each equal share of the frames
+    cuts = []
+    for k in range(1, segments):
+        target = len(index['timestamps']) * k // segments
+        for frame_index, timestamp in keyframes:
+            if frame_index >= target and (not cuts or frame_index > cuts[-1][0]):
+                cuts.append((frame_index, timestamp))
+                break
+    if not cuts:
+        return None
+    
+    # The segment muxer cuts at the first keyframe at or after each time, so
+    # aim just before each keyframe to stay clear of rounding
+    pattern = os.path.join(work_dir, 'segment%03d.mp4')
+    if not run_ffmpeg(['-i', video_path, '-map', '0:v:0', '-c', 'copy',
+                       '-f', 'segment', '-reset_timestamps', '1',
+                       '-segment_times', ','.join(f'{max(timestamp - 0.001, 0):.6f}' for _, timestamp in cuts),
+                       pattern]):
+        return None
+    
+    first_frames = [0] + [frame_index for frame_index, _ in cuts]
+    paths = [pattern % k for k in range(len(first_frames))]
+    if not all(os.path.exists(path) for path in paths) or os.path.exists(pattern % len(paths)):
+        return None
+    return list(zip(paths, first_frames))
+
+def render_segment(mode, segment_path, thumbnail_path, output_path, options):
+    """Render one segment in a worker process (see render_in_segments)"""
+    if mode == 'intro':
+        return create_thumbnail_intro(segment_path, thumbnail_path, output_path, **options)
+    return add_thumbnail_overlay(segment_path, thumbnail_path, output_path, **options)
+
+def render_in_segments(mode, video_path, thumbnail_path, output_path, segments, options):
+    """
+    Render a video as keyframe-aligned segments across a process pool
+    
+    The input is cut at keyframes, every segment is rendered in its own worker
+    process (with the intro or overlay where it applies and passed through
+    otherwise), and the rendered segments are joined without re-encoding.
+    
+    Args:
+        mode (str): 'intro' or 'overlay'
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+        segments (int): Number of segments to render in parallel
+        options (dict): Keyword arguments for create_thumbnail_intro or add_thumbnail_overlay
+    
+    Returns:
+        bool: Success status (False if the video can't be split)
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        parts = split_at_keyframes(video_path, segments, work_dir)
+        if parts is None:
+            return False
+        
+        jobs = []
+        for k, (segment_path, first_frame) in enumerate(parts):
+            segment_options = dict(options)
+            if mode == 'intro':
+                if k > 0:
+                    segment_options['intro_duration_sec'] = 0
+            else:
+                segment_options['duration_frames'] = max(options['duration_frames'] - first_frame, 0)
+            jobs.append((mode, segment_path, thumbnail_path,
+                         os.path.join(work_dir, f'rendered{k:03d}.mp4'), segment_options))
+        
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(worker_module().render_segment, *zip(*jobs)))
+        if not all(results):
+            return False
+        
+        # The first segment's worker rounds the intro down to whole frames, so delay the audio by those
+        audio_offset = 0
+        if mode == 'intro':
+            cap = cv2.VideoCapture(parts[0][0])
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            cap.release()
+            if fps > 0:
+                audio_offset = int(fps * options['intro_duration_sec']) / fps
+        return concat_streams([job[3] for job in jobs], output_path,
+                              audio_path=video_path, audio_offset=audio_offset)
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def render_thumbnail_variants(video_path, variants, queue_depth=8, stats=None, encoder=None):
+    """
+    Render several thumbnail variants of one video from a single decode
+    
+    Every decoded frame is fed to one compositor+encoder branch per variant,
+    so the cost is close to one decode plus one encode per variant.
+    
+    Args:
+        video_path (str): Path to input video file
+        variants (list): Dicts with mode ('intro' or 'overlay'), thumbnail_path and
+            output_path, plus intro_duration_sec for intros or position, size_ratio
+            and duration_frames for overlays
+        queue_depth (int): Frames buffered for each variant
+        stats (dict): Filled with per-branch pipeline timings when given
+        encoder (dict): Encoder backend settings (see open_video_writer)
+    
+    Returns:
+        bool: Success status (errors are raised so the caller can show them)
+    """
+    writers = []
+    try:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return False
+        
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        
+        def intro_writer(out, thumbnail, intro_frames):
+            def start():
+                for _ in range(intro_frames):
+                    out.write(thumbnail)
+            return start
+        
+        def overlay_composer(overlay, x, y, duration_frames):
+            # Frames are shared with the other branches, so blend into a private copy
+            buffer = [None]
+            
+            def compose_frame(index, frame):
+                if index >= duration_frames:
+                    return frame
+                if buffer[0] is None:
+                    buffer[0] = np.empty_like(frame)
+                np.copyto(buffer[0], frame)
+                return blend_overlay(buffer[0], overlay, x, y)
+            
+            return compose_frame
+        
+        branches = []
+        for variant in variants:
+            out = open_video_writer(variant['output_path'], fps, width, height, encoder)
+            writers.append(out)
+            
+            if variant['mode'] == 'intro':
+                thumbnail = cv2.resize(load_thumbnail(variant['thumbnail_path']), (width, height))
+                intro_frames = int(fps * variant.get('intro_duration_sec', 3))
+                branches.append({
+                    'start': intro_writer(out, thumbnail, intro_frames),
+                    'compose': lambda index, frame: frame,
+                    'write': out.write
+                })
+            else:
+                overlay, x, y = prepare_overlay_thumbnail(
+                    variant['thumbnail_path'], width, height,
+                    variant.get('position', 'top-right'), variant.get('size_ratio', 0.2)
+                )
+                branches.append({
+                    'compose': overlay_composer(overlay, x, y, variant.get('duration_frames', 90)),
+                    'write': out.write
+                })
+        
+        # Decode once into recycled buffers shared by every branch
+        pool = allocate_frame_pool(width, height, queue_depth, 0)
+        try:
+            pipeline_stats = run_fanout_pipeline(capture_reader(cap, pool=pool), branches, queue_depth, pool.put)
+        finally:
+            cap.release()
+        
+        if stats is not None:
+            stats.update(pipeline_stats)
+        
+        return True
+    
+    finally:
+        for out in writers:
+            out.release()
+
+# Video file extensions accepted by the uploaders and batch directory scans
+VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'mkv']
+
+def init_batch_worker(cv_threads):
+    """Process pool initializer: cap OpenCV's own threads so workers don't oversubscribe cores"""
+    cv2.setNumThreads(cv_threads)
+
+def render_batch_job(job):
+    """
+    Render one video of a batch in a worker process
+    
+    Args:
+        job (dict): mode ('intro', 'overlay' or 'cover'), video_path, thumbnail_path,
+            output_path, an optional encoder and the mode's options (intro_duration_sec,
+            or position, size_ratio, overlay_duration_sec and smart_render)
+    
+    Returns:
+        dict: The job's video_path and output_path with success, seconds taken and render warnings
+    """
+    start = time.perf_counter()
+    video_path, thumbnail_path, output_path = job['video_path'], job['thumbnail_path'], job['output_path']
+    warnings = []
+    
+    if job['mode'] == 'intro':
+        success = create_thumbnail_intro(video_path, thumbnail_path, output_path, job['intro_duration_sec'],
+                                         stream_copy=True, threads=1, encoder=job.get('encoder'), warnings=warnings)
+    elif job['mode'] == 'cover':
+        success = embed_thumbnail_cover(video_path, thumbnail_path, output_path)
+    else:
+        # Overlay duration is given in seconds since every video has its own frame rate
+        duration_frames = frames_until(video_path, job['overlay_duration_sec'])
+        success = add_thumbnail_overlay(video_path, thumbnail_path, output_path, job['position'], job['size_ratio'],
+                                        duration_frames, job.get('smart_render', True), threads=1,
+                                        encoder=job.get('encoder'), warnings=warnings)
+    
+    return {
+        'video_path': video_path,
+        'output_path': output_path,
+        'success': bool(success and os.path.exists(output_path)),
+        'seconds': time.perf_counter() - start,
+        'warnings': warnings
+    }
+
+def run_batch(jobs, workers=None):
+    """
+    Render a batch of videos on a process pool, yielding each result as it finishes
+    
+    Args:
+        jobs (list): Job dicts for render_batch_job
+        workers (int): Worker processes, capped at the CPU count (default: CPU count)
+    
+    Yields:
+        dict: Result of render_batch_job, in completion order
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, cpu_count, len(jobs)))
+    
+    # Share the cores between workers instead of letting each OpenCV use all of them
+    cv_threads = max(1, cpu_count // workers)
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=worker_module().init_batch_worker,
+                             initargs=(cv_threads,)) as executor:
+        futures = {executor.submit(worker_module().render_batch_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'video_path': job['video_path'], 'output_path': job['output_path'],
+                       'success': False, 'seconds': 0, 'error': str(e)}
+
+def embed_thumbnail_cover(video_path, thumbnail_path, output_path):
+    """
+    Embed thumbnail as MP4 cover art without re-encoding the video
+    
+    The thumbnail is written as an attached picture (the MP4 'covr' atom) and
+    the video and audio streams are remuxed as-is.
+    
+    Args:
+        video_path (str): Path to input video file
+        thumbnail_path (str): Path to thumbnail image
+        output_path (str): Path for output video file
+    
+    Returns:
+        bool: Success status (errors are raised, so a background job can report them)
+    """
+    # The cover is mapped after every video stream of the source, so it's the output's last one
+    stream = probe_video_stream(video_path)
+    if stream is None:
+        return False
+    
+    cover_path = thumbnail_path
+    try:
+        # MP4 cover art has to be JPEG or PNG
+        if os.path.splitext(thumbnail_path)[1].lower() not in ('.jpg', '.jpeg', '.png'):
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_cover:
+                cover_path = tmp_cover.name
+            Image.open(thumbnail_path).save(cover_path, format='PNG')
+        
+        return run_ffmpeg([
+            '-i', video_path, '-i', cover_path,
+            '-map', '0:V', '-map', '0:a?', '-map', '1',
+            '-c', 'copy', f"-disposition:v:{stream['video_streams']}", 'attached_pic',
+            '-movflags', '+faststart', output_path
+        ])
+    
+    finally:
+        if cover_path != thumbnail_path and os.path.exists(cover_path):
+            os.unlink(cover_path)
+
+SEEK_MODES = {
+    'fast': "⚡ Fast (nearest keyframe)",
+    'accurate': "🎯 Accurate (exact frame)",
+}
+
+PACKET_INDEX_DIR = os.path.join(CACHE_ROOT, 'packet_indexes')
+PACKET_INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+def video_cache_key(video_path, content_hash=None):
+    """Cache key of a video: its content hash when known, else a digest of its path, size and mtime"""
+    if content_hash is not None:
+        return content_hash
+    stat = os.stat(video_path)
+    return hashlib.sha256(repr((os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)).encode()).hexdigest()
+
+def build_packet_index(video_path):
+    """
+    Packet index of the first video stream: MP4/MOV sample tables, else a demux-only ffmpeg pass
+    
+    Returns:
+        dict: time_base plus pts, keyframe and byte offset arrays in decode order
+        (offsets are -1 when the container was demuxed by ffmpeg), or None
+    """
+    with open(video_path, 'rb') as f:
+        magic = f.read(8)
+    if magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+        try:
+            index = parse_mp4_packet_index(video_path)
+        except (OSError, struct.error, ValueError, IndexError, TypeError):
+            index = None
+        if index is not None:
+            return index
+    
+    index = read_packet_index(video_path)
+    if index is None:
+        return None
+    return {
+        'time_base': index['time_base'],
+        'pts': np.array(index['pts'], dtype=np.int64),
+        'keyframe': np.array(index['keyframe'], dtype=bool),
+        'offset': np.full(len(index['pts']), -1, dtype=np.int64),
+    }
+
+def load_packet_index(video_path, cache_key):
+    """Packet index from the disk cache, building and storing it on a miss"""
+    cached = cache_lookup(PACKET_INDEX_DIR, cache_key, suffix='.npz')
+    if cached is not None:
+        try:
+            with np.load(cached) as data:
+                return {
+                    'time_base': float(data['time_base']),
+                    'pts': data['pts'],
+                    'keyframe': data['keyframe'],
+                    'offset': data['offset'],
+                }
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    index = build_packet_index(video_path)
+    if index is None:
+        return None
+    os.makedirs(PACKET_INDEX_DIR, exist_ok=True)
+    tmp_path = os.path.join(PACKET_INDEX_DIR, f"{cache_key}.{os.getpid()}.{threading.get_ident()}.build.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **index)
+    cache_store(PACKET_INDEX_DIR, cache_key, tmp_path, PACKET_INDEX_MAX_BYTES, suffix='.npz')
+    return index
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_keyframe_index(_video_path, cache_key):
+    """Frame timestamps in presentation order and keyframe positions; only cache_key keys the cache"""
+    index = load_packet_index(_video_path, cache_key)
+    if index is None:
+        return None
+    
+    pts = index['pts']
+    order = np.argsort(pts, kind='stable')
+    return {
+        'start': pts[order[0]] * index['time_base'],
+        'timestamps': (pts[order] - pts[order[0]]) * index['time_base'],
+        'keyframes': np.flatnonzero(index['keyframe'][order]),
+    }
+
+def get_keyframe_index(video_path, content_hash=None):
+    """Cached keyframe index of a video, keyed by content hash when known, otherwise rebuilt when the file changes"""
+    return load_keyframe_index(video_path, video_cache_key(video_path, content_hash))
+
+def frames_until(video_path, seconds, content_hash=None):
+    """Number of frames shown before a point in time, counted from the packet index so variable frame rates come out right"""
+    index = get_keyframe_index(video_path, content_hash)
+    if index is not None:
+        return int(np.searchsorted(index['timestamps'], seconds - 1e-6))
+    info = get_video_info(video_path, content_hash)
+    return int(info['fps'] * seconds) if info else 150
+
+PREVIEW_CACHE_DIR = os.path.join(CACHE_ROOT, 'previews')
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PREVIEW_WIDTH = 320
+
+def build_preview_proxy(video_path, content_hash, width=PREVIEW_WIDTH):
+    """
+    Decode only the keyframes of a video, downscaled, into a memory-mappable proxy
+    
+    The proxy is a (keyframes, height, width, 3) uint8 .npy array plus a .npy of
+    keyframe timestamps, stored in the preview cache under the content hash.
+    
+    Args:
+        video_path (str): Path to input video file
+        content_hash (str): Hash of the video's content
+        width (int): Width of the preview frames
+    
+    Returns:
+        bool: True if the proxy was built (False if it wouldn't fit in the preview cache)
+    """
+    ffmpeg = get_ffmpeg_path()
+    index = get_keyframe_index(video_path, content_hash)
+    info = get_video_info(video_path, content_hash)
+    if ffmpeg is None or index is None or not info or not info['width']:
+        return False
+    
+    height = max(2, round(width * info['height'] / info['width'] / 2) * 2)
+    keyframe_times = index['timestamps'][index['keyframes']]
+    frame_bytes = width * height * 3
+    
+    # A proxy the cache can't hold would only evict everything else and itself
+    if len(keyframe_times) * (frame_bytes + keyframe_times.itemsize) > PREVIEW_CACHE_MAX_BYTES:
+        return False
+    
+    os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+    build_id = f"{content_hash}.{os.getpid()}.{threading.get_ident()}"
+    frames_path = os.path.join(PREVIEW_CACHE_DIR, f"{build_id}.frames.tmp")
+    times_path = os.path.join(PREVIEW_CACHE_DIR, f"{build_id}.times.tmp")
+    
+    frames = np.lib.format.open_memmap(frames_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(keyframe_times), height, width, 3))
+    # The decoder skips everything but keyframes, so no other frame is decoded at all
+    process = subprocess.Popen(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-skip_frame', 'nokey', '-i', video_path,
+         '-map', '0:v:0', '-vf', f'scale={width}:{height}', '-fps_mode', 'passthrough',
+         '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    count = 0
+    try:
+        while count < len(keyframe_times):
+            chunk = process.stdout.read(frame_bytes)
+            if len(chunk) < frame_bytes:
+                break
+            frames[count] = np.frombuffer(chunk, np.uint8).reshape(height, width, 3)
+            count += 1
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        frames.flush()
+        del frames
+    
+    if count == 0:
+        os.unlink(frames_path)
+        return False
+    
+    # Frames beyond count stay zero; the timestamps array says how many are valid
+    with open(times_path, 'wb') as f:
+        np.save(f, keyframe_times[:count])
+    # Both files make one entry, so storing the frames must not evict the timestamps
+    times_path = cache_store(PREVIEW_CACHE_DIR, content_hash, times_path, PREVIEW_CACHE_MAX_BYTES, suffix='.times.npy')
+    cache_store(PREVIEW_CACHE_DIR, content_hash, frames_path, PREVIEW_CACHE_MAX_BYTES, suffix='.frames.npy',
+                in_use=(times_path,))
+    return True
+
+def load_preview_proxy(content_hash):
+    """Memory-mapped preview proxy of a video, or None if it has not been built"""
+    times_path = cache_lookup(PREVIEW_CACHE_DIR, content_hash, suffix='.times.npy')
+    frames_path = cache_lookup(PREVIEW_CACHE_DIR, content_hash, suffix='.frames.npy')
+    if times_path is None or frames_path is None:
+        return None
+    try:
+        times = np.load(times_path)
+        return {'times': times, 'frames': np.load(frames_path, mmap_mode='r')[:len(times)]}
+    except (OSError, ValueError):
+        return None
+
+def preview_frame(proxy, timestamp):
+    """The proxy keyframe at or before timestamp, with its time"""
+    k = max(int(np.searchsorted(proxy['times'], timestamp, side='right')) - 1, 0)
+    return proxy['frames'][k], float(proxy['times'][k])
+
+@st.cache_resource
+def get_preview_builder():
+    """Background thread that builds preview proxies, with the builds started per content hash"""
+    return {'executor': ThreadPoolExecutor(max_workers=1), 'builds': {}, 'lock': threading.Lock()}
+
+def run_preview_build(source_path, content_hash):
+    """Build a preview proxy from a private link to the upload, then remove the link; True only if it loads"""
+    try:
+        return build_preview_proxy(source_path, content_hash) and load_preview_proxy(content_hash) is not None
+    finally:
+        os.unlink(source_path)
+
+def start_preview_proxy(video_path, content_hash):
+    """
+    Return a video's preview proxy, starting a background build if there is none
+    
+    Returns:
+        dict: The proxy (see load_preview_proxy), None while it is being built, or False if the
+        video gets no proxy (it's too large for the preview cache, or the build failed)
+    """
+    proxy = load_preview_proxy(content_hash)
+    if proxy is not None:
+        return proxy
+    
+    builder = get_preview_builder()
+    with builder['lock']:
+        build = builder['builds'].get(content_hash)
+        # Rebuild only after eviction; a failed build (False or an exception) is not retried
+        if build is not None and not build.done():
+            return None
+        if build is not None and (build.exception() is not None or not build.result()):
+            return False
+        
+        os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+        source_path = os.path.join(PREVIEW_CACHE_DIR, f"{content_hash}.source.{threading.get_ident()}.tmp")
+        try:
+            os.link(video_path, source_path)
+        except OSError:
+            shutil.copyfile(video_path, source_path)
+        builder['builds'][content_hash] = builder['executor'].submit(run_preview_build, source_path, content_hash)
+    return None
+
+FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+class FrameCache:
+    """Thread-safe LRU of decoded frames bounded by their total size in bytes"""
+    
+    def __init__(self, max_bytes=FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        """Cached seek result for key, or None"""
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+    
+    def put(self, key, result):
+        """Cache a seek result, evicting the least recently used frames to stay within max_bytes"""
+        frame_bytes = result['frame'].nbytes
+        if frame_bytes > self.max_bytes:
+            return
+        # Cached frames are shared between callers, so nobody may modify them in place
+        result['frame'].flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)['frame'].nbytes
+            self.entries[key] = result
+            self.size += frame_bytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted['frame'].nbytes
+                self.evictions += 1
+    
+    def stats(self):
+        """Hit/miss counters and current usage"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'frames': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+@st.cache_resource
+def get_frame_cache():
+    """The decoded-frame cache shared by every session of this server process"""
+    return FrameCache(FRAME_CACHE_MAX_BYTES)
+
+def decode_frame_at(video_path, timestamp, fast=False):
+    """
+    Decode one frame with an ffmpeg input seek
+    
+    Args:
+        video_path (str): Path to input video file
+        timestamp (float): Absolute stream time to seek to in seconds
+        fast (bool): Return the keyframe at or before timestamp instead of decoding forward to it
+    
+    Returns:
+        numpy.ndarray: BGR frame, or None
+    """
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-seek_timestamp', '1',
+             *(['-noaccurate_seek'] if fast else []), '-ss', f'{timestamp:.6f}', '-i', video_path,
+             '-map', '0:v:0', '-frames:v', '1', '-c:v', 'bmp', '-f', 'image2pipe', '-'],
+            capture_output=True
+        )
+    except Exception:
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return cv2.imdecode(np.frombuffer(result.stdout, np.uint8), cv2.IMREAD_COLOR)
+
+def seek_frame_opencv(video_path, position=0.1, frame_index=None):
+    """Frame at a relative position (or frame_index) using OpenCV's own seeking; fallback when there is no keyframe index"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_number = int(total_frames * position) if frame_index is None else frame_index
+        
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    
+    if not ret:
+        return None
+    return {'frame': frame, 'frame_index': frame_number, 'timestamp': timestamp, 'keyframe': None}
+
+def decode_indexed_frame(video_path, index, target):
+    """
+    Decode one frame by number, placing the ffmpeg seek with the keyframe index
+    
+    Returns:
+        dict: BGR frame, frame_index, timestamp and keyframe flag, or None
+    """
+    timestamps = index['timestamps']
+    is_keyframe = bool(np.isin(target, index['keyframes']))
+    if is_keyframe:
+        # An accurate seek to the keyframe's own time starts decoding at it, so only that frame is
+        # decoded; a fast seek can land on the frame before it in some containers (e.g. MKV)
+        seek_time = timestamps[target]
+    else:
+        # Seek half a frame before the target so the decoder keeps the exact frame
+        seek_time = (timestamps[target - 1] + timestamps[target]) / 2
+    
+    frame = decode_frame_at(video_path, index['start'] + seek_time)
+    if frame is None:
+        return None
+    return {
+        'frame': frame,
+        'frame_index': int(target),
+        'timestamp': float(timestamps[target]),
+        'keyframe': is_keyframe,
+    }
+
+def seek_frame(video_path, position=0.1, seek='accurate', frame_index=None, content_hash=None):
+    """
+    Decode the frame at a relative position using the video's keyframe index
+    
+    'fast' snaps to the nearest keyframe, which decodes a single frame; 'accurate'
+    seeks to the keyframe before the position and decodes forward to the exact frame.
+    
+    Args:
+        video_path (str): Path to input video file
+        position (float): Relative position in the video (0.0 - 1.0)
+        seek (str): 'fast' or 'accurate'
+        frame_index (int): Exact frame number to seek to instead of position
+        content_hash (str): Hash of the video's content; when given, frames are served
+            from and stored in the process-wide frame cache
+    
+    Returns:
+        dict: BGR frame plus the frame_index, timestamp (seconds) and keyframe flag of
+        the frame actually returned, or None
+    """
+    try:
+        index = get_keyframe_index(video_path, content_hash)
+    except Exception:
+        index = None
+    if index is None or not len(index['keyframes']):
+        return seek_frame_opencv(video_path, position, frame_index)
+    
+    timestamps, keyframes = index['timestamps'], index['keyframes']
+    target = int(len(timestamps) * position) if frame_index is None else frame_index
+    target = min(max(target, 0), len(timestamps) - 1)
+    following = np.searchsorted(keyframes, target)
+    if following < len(keyframes) and keyframes[following] == target:
+        preceding = following
+    else:
+        preceding = max(following - 1, 0)
+    
+    if seek == 'fast':
+        # Nearest keyframe on either side of the requested frame
+        if following < len(keyframes) and keyframes[following] - target < abs(target - keyframes[preceding]):
+            target = keyframes[following]
+        else:
+            target = keyframes[preceding]
+    else:
+        target = max(target, keyframes[preceding])
+    
+    frame_cache = get_frame_cache() if content_hash is not None else None
+    if frame_cache is not None:
+        result = frame_cache.get((content_hash, int(target)))
+        if result is not None:
+            return result
+    
+    result = decode_indexed_frame(video_path, index, target)
+    if result is None:
+        return seek_frame_opencv(video_path, position, frame_index)
+    if frame_cache is not None:
+        frame_cache.put((content_hash, int(target)), result)
+    return result
+
+# Rough cost of starting an ffmpeg seek, in frames decoded by grab()
+SEEK_COST_FRAMES = 30
+
+def extract_frames(video_path, positions=None, count=10, seek='accurate', frame_indices=None):
+    """
+    Decode several frames in one sorted pass over the video
+    
+    The capture only moves forward: frames between targets are skipped with grab(),
+    which never converts them to BGR. When the keyframe index shows that decoding
+    from the target's own keyframe is cheaper than grabbing the gap, that target is
+    decoded with an ffmpeg seek instead. With seek='fast' each position snaps to its
+    nearest keyframe and only keyframes are decoded.
+    
+    Args:
+        video_path (str): Path to input video file
+        positions (list): Relative positions (0.0 - 1.0); defaults to count evenly spaced positions
+        count (int): Number of frames when positions is not given
+        seek (str): 'fast' or 'accurate', as for seek_frame
+        frame_indices (list): Exact frame numbers to decode instead of positions (accurate seeking only)
+    
+    Returns:
+        list: dicts with the BGR frame, frame_index, timestamp and keyframe flag, in frame order
+    """
+    if positions is None:
+        positions = [(k + 0.5) / count for k in range(count)]
+    
+    try:
+        index = get_keyframe_index(video_path)
+    except Exception:
+        index = None
+    if index is not None and not len(index['keyframes']):
+        index = None
+    
+    if seek == 'fast' and index is not None and frame_indices is None:
+        # Nearby positions can snap to the same keyframe
+        frames = {}
+        for position in positions:
+            result = seek_frame(video_path, position, 'fast')
+            if result is not None:
+                frames.setdefault(result['frame_index'], result)
+        return [frames[target] for target in sorted(frames)]
+    
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return []
+    
+    try:
+        if index is not None:
+            total_frames = len(index['timestamps'])
+            keyframes = index['keyframes']
+        else:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            keyframes = np.zeros(0, dtype=np.int64)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        if total_frames <= 0:
+            return []
+        
+        if frame_indices is None:
+            frame_indices = [int(total_frames * position) for position in positions]
+        targets = sorted({min(max(target, 0), total_frames - 1) for target in frame_indices})
+        
+        frames = []
+        current = 0
+        for target in targets:
+            if len(keyframes):
+                preceding = keyframes[max(np.searchsorted(keyframes, target, side='right') - 1, 0)]
+                if target - current > target - preceding + SEEK_COST_FRAMES:
+                    result = decode_indexed_frame(video_path, index, target)
+                    if result is not None:
+                        frames.append(result)
+                        continue
+            
+            while current < target and cap.grab():
+                current += 1
+            ret, frame = cap.read()
+            if not ret:
+                break
+            current += 1
+            frames.append({
+                'frame': frame,
+                'frame_index': target,
+                'timestamp': float(index['timestamps'][target]) if index is not None else target / fps,
+                'keyframe': bool(np.isin(target, keyframes)) if index is not None else None,
+            })
+    finally:
+        cap.release()
+    
+    return frames
+
+def build_contact_sheet(frames, columns=5, tile_width=320, label=True):
+    """
+    Tile extracted frames into one contact-sheet image
+    
+    Args:
+        frames (list): Results of extract_frames
+        columns (int): Tiles per row
+        tile_width (int): Width of each tile in pixels
+        label (bool): Stamp each tile with its timestamp
+    
+    Returns:
+        PIL.Image: RGB contact sheet, or None when there are no frames
+    """
+    if not frames:
+        return None
+    
+    height, width = frames[0]['frame'].shape[:2]
+    tile_height = max(1, round(tile_width * height / width))
+    columns = min(columns, len(frames))
+    rows = (len(frames) + columns - 1) // columns
+    sheet = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    
+    for k, result in enumerate(frames):
+        tile = cv2.resize(result['frame'], (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+        if label:
+            minutes, seconds = divmod(result['timestamp'], 60)
+            text = f"{int(minutes)}:{seconds:05.2f}"
+            cv2.putText(tile, text, (6, tile_height - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(tile, text, (6, tile_height - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+        row, column = divmod(k, columns)
+        sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = tile
+    
+    return Image.fromarray(cv2.cvtColor(sheet, cv2.COLOR_BGR2RGB))
+
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def perceptual_hash(frame, method='phash'):
+    """
+    64-bit perceptual hash of a BGR or greyscale frame
+    
+    Args:
+        frame (numpy.ndarray): Frame to hash
+        method (str): 'ahash' (8x8 above the mean), 'dhash' (horizontal gradients of
+            9x8) or 'phash' (low-frequency DCT coefficients above their median)
+    
+    Returns:
+        int: The hash as an unsigned 64-bit integer
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if method == 'ahash':
+        small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32)
+        bits = small > small.mean()
+    elif method == 'dhash':
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.float32)
+        bits = small[:, 1:] > small[:, :-1]
+    elif method == 'phash':
+        small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:8, :8].ravel()
+        # The DC term only tracks overall brightness, so it is left out of the median
+        bits = low > np.median(low[1:])
+    else:
+        raise ValueError(f"Unknown hash method: {method}")
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+def hamming_distances(hashes, value):
+    """Bit differences between one hash and an array of uint64 hashes"""
+    differing = np.bitwise_xor(hashes, np.uint64(value))
+    return POPCOUNT_TABLE[differing.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class HashIndex:
+    """Perceptual hashes of representative frames, looked up by Hamming distance"""
+    
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        self.hashes = np.zeros(64, dtype=np.uint64)
+        self.size = 0
+    
+    def match(self, value):
+        """Position of the closest stored hash within max_distance, or None"""
+        if self.size == 0:
+            return None
+        distances = hamming_distances(self.hashes[:self.size], value)
+        closest = int(distances.argmin())
+        return closest if distances[closest] <= self.max_distance else None
+    
+    def add(self, value):
+        """Store a hash and return its position"""
+        if self.size == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.hashes[self.size] = value
+        self.size += 1
+        return self.size - 1
+
+def dedupe_frames(frames, method='phash', max_distance=6):
+    """Drop extracted frames that are near-duplicates of an earlier one; each kept frame gets a duplicates count"""
+    index = HashIndex(max_distance)
+    kept = []
+    for result in frames:
+        value = perceptual_hash(result['frame'], method)
+        match = index.match(value)
+        if match is None:
+            index.add(value)
+            result['duplicates'] = 0
+            kept.append(result)
+        else:
+            kept[match]['duplicates'] += 1
+    return kept
+
+SCORE_WEIGHTS = {
+    'sharpness': 0.4,
+    'exposure': 0.25,
+    'colorfulness': 0.2,
+    'faces': 0.15,
+}
+
+def load_face_cascade():
+    """OpenCV's bundled frontal-face Haar cascade, or None when this build ships without it"""
+    cascade_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+    cascade_path = os.path.join(cascade_dir, 'haarcascade_frontalface_default.xml')
+    if not os.path.exists(cascade_path):
+        return None
+    cascade = cv2.CascadeClassifier(cascade_path)
+    return None if cascade.empty() else cascade
+
+def sample_video_frames(video_path, sample_fps=2, width=320):
+    """
+    Stream downscaled frames at a fixed sampling rate
+    
+    Frames between samples are skipped with grab(), so only the samples are
+    converted to BGR and resized.
+    
+    Yields:
+        tuple: (frame_index, small BGR frame)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return
+    
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        step = max(1, round(fps / sample_fps))
+        frame_index = 0
+        size = None
+        while cap.grab():
+            if frame_index % step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if size is None:
+                    height, frame_width = frame.shape[:2]
+                    size = (width, max(2, round(width * height / frame_width)))
+                yield frame_index, cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            frame_index += 1
+    finally:
+        cap.release()
+
+def score_frames(batch, face_cascade=None):
+    """
+    Score a batch of downscaled frames for thumbnail quality
+    
+    Args:
+        batch (numpy.ndarray): (N, height, width, 3) uint8 BGR frames
+        face_cascade (cv2.CascadeClassifier): Optional face detector
+    
+    Returns:
+        dict: per-frame arrays of raw sharpness (Laplacian variance), exposure
+        (0-1, best at mid grey with little clipping), colorfulness and face counts
+    """
+    frames = batch.astype(np.float32)
+    blue, green, red = frames[..., 0], frames[..., 1], frames[..., 2]
+    gray = 0.114 * blue + 0.587 * green + 0.299 * red
+    
+    # 4-neighbour Laplacian over the whole batch at once
+    laplacian = (gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1] + gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:]
+                 - 4 * gray[:, 1:-1, 1:-1])
+    sharpness = laplacian.reshape(len(batch), -1).var(axis=1)
+    
+    flat_gray = gray.reshape(len(batch), -1)
+    clipped = ((flat_gray < 16) | (flat_gray > 239)).mean(axis=1)
+    exposure = np.clip(1 - np.abs(flat_gray.mean(axis=1) / 255 - 0.5) * 2 - clipped, 0, 1)
+    
+    # Hasler and Suesstrunk's colorfulness metric
+    rg = (red - green).reshape(len(batch), -1)
+    yb = (0.5 * (red + green) - blue).reshape(len(batch), -1)
+    colorfulness = (np.sqrt(rg.std(axis=1) ** 2 + yb.std(axis=1) ** 2)
+                    + 0.3 * np.sqrt(rg.mean(axis=1) ** 2 + yb.mean(axis=1) ** 2))
+    
+    faces = np.zeros(len(batch))
+    if face_cascade is not None:
+        for k, small_gray in enumerate(gray.astype(np.uint8)):
+            faces[k] = len(face_cascade.detectMultiScale(small_gray, scaleFactor=1.2, minNeighbors=5))
+    
+    return {'sharpness': sharpness, 'exposure': exposure, 'colorfulness': colorfulness, 'faces': faces}
+
+def combine_scores(metrics, weights=None):
+    """Weighted 0-1 score per frame from score_frames metrics normalized across the whole video"""
+    weights = weights or SCORE_WEIGHTS
+    sharpness = np.log1p(metrics['sharpness'])
+    normalized = {
+        'sharpness': sharpness / sharpness.max() if sharpness.max() > 0 else sharpness,
+        'exposure': metrics['exposure'],
+        'colorfulness': metrics['colorfulness'] / max(metrics['colorfulness'].max(), 1e-6),
+        'faces': np.minimum(metrics['faces'], 1),
+    }
+    return sum(weights[name] * normalized[name] for name in weights)
+
+def auto_pick_thumbnails(video_path, count=5, sample_fps=2, width=320, detect_faces=False,
+                         batch_size=32, min_gap_sec=1.0, hash_method='phash', max_hash_distance=6):
+    """
+    Pick the best thumbnail candidates from a video
+    
+    One streaming pass samples frames at reduced resolution. Frames whose perceptual
+    hash is within max_hash_distance of an earlier sample are collapsed into it
+    before scoring, and the rest are scored in batches. The top-scoring frames
+    that are not close in time to a better pick are then decoded at full resolution.
+    
+    Args:
+        video_path (str): Path to input video file
+        count (int): Number of candidates to return
+        sample_fps (float): Frames sampled per second of video
+        width (int): Width frames are scored at
+        detect_faces (bool): Reward frames with faces (when OpenCV ships the Haar cascade)
+        batch_size (int): Frames scored together
+        min_gap_sec (float): Minimum time between candidates
+        hash_method (str): 'ahash', 'dhash' or 'phash', see perceptual_hash
+        max_hash_distance (int): Hamming distance (of 64 bits) up to which frames are duplicates
+    
+    Returns:
+        list: extract_frames results with score, metrics and the number of collapsed
+        duplicates added, best first
+    """
+    face_cascade = load_face_cascade() if detect_faces else None
+    hash_index = HashIndex(max_hash_distance)
+    
+    frame_indices, duplicates, batch = [], [], []
+    metrics = {name: [] for name in SCORE_WEIGHTS}
+    
+    def flush():
+        scores = score_frames(np.stack(batch), face_cascade)
+        for name in metrics:
+            metrics[name].append(scores[name])
+        batch.clear()
+    
+    for frame_index, frame in sample_video_frames(video_path, sample_fps, width):
+        frame_hash = perceptual_hash(frame, hash_method)
+        match = hash_index.match(frame_hash)
+        if match is not None:
+            duplicates[match] += 1
+            continue
+        hash_index.add(frame_hash)
+        frame_indices.append(frame_index)
+        duplicates.append(0)
+        batch.append(frame)
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+    if not frame_indices:
+        return []
+    
+    metrics = {name: np.concatenate(values) for name, values in metrics.items()}
+    scores = combine_scores(metrics)
+    
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    
+    picked = []
+    for k in np.argsort(-scores, kind='stable'):
+        if any(abs(frame_indices[k] - frame_indices[j]) < min_gap_sec * fps for j in picked):
+            continue
+        picked.append(k)
+        if len(picked) == count:
+            break
+    
+    candidates = {result['frame_index']: result
+                  for result in extract_frames(video_path, frame_indices=[frame_indices[k] for k in picked])}
+    results = []
+    for k in picked:
+        if frame_indices[k] in candidates:
+            result = candidates[frame_indices[k]]
+            result['score'] = float(scores[k])
+            result['metrics'] = {name: float(values[k]) for name, values in metrics.items()}
+            result['duplicates'] = duplicates[k]
+            results.append(result)
+    return results
+
+def extract_thumbnail_from_video(video_path, position=0.1, seek='accurate'):
+    """Extract a frame from video as thumbnail"""
+    try:
+        result = seek_frame(video_path, position, seek)
+        if result:
+            # Convert BGR to RGB for PIL
+            frame_rgb = cv2.cvtColor(result['frame'], cv2.COLOR_BGR2RGB)
+            return Image.fromarray(frame_rgb)
+        
+        return None
+        
+    except:
+        return None
+
+# Sample-entry fourccs and Matroska codec IDs mapped to ffmpeg's codec names
+MP4_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc', 'mp4v': 'mpeg4',
+    'vp08': 'vp8', 'vp09': 'vp9', 'av01': 'av1', 'apcn': 'prores', 'apch': 'prores', 'jpeg': 'mjpeg',
+}
+MKV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc', 'V_MPEG4/ISO/SP': 'mpeg4', 'V_MPEG4/ISO/ASP': 'mpeg4',
+    'V_VP8': 'vp8', 'V_VP9': 'vp9', 'V_AV1': 'av1', 'V_MJPEG': 'mjpeg',
+}
+
+def read_mp4_boxes(f, start, end):
+    """Yield (type, payload_start, box_end) for each box between two file offsets"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+def find_mp4_box(f, start, end, path):
+    """(payload_start, box_end) of the box at a path of nested box types, or None"""
+    for box_type, payload_start, box_end in read_mp4_boxes(f, start, end):
+        if box_type == path[0]:
+            return (payload_start, box_end) if len(path) == 1 else find_mp4_box(f, payload_start, box_end, path[1:])
+    return None
+
+def parse_mp4_track(f, start, end):
+    """Handler, codec, dimensions, rotation, timing and sample count of one MP4 trak box"""
+    track = {}
+    hdlr = find_mp4_box(f, start, end, [b'mdia', b'hdlr'])
+    if hdlr:
+        f.seek(hdlr[0] + 8)
+        track['handler'] = f.read(4).decode('latin-1')
+    
+    mdhd = find_mp4_box(f, start, end, [b'mdia', b'mdhd'])
+    if mdhd:
+        f.seek(mdhd[0])
+        version = f.read(4)[0]
+        if version == 1:
+            _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+        else:
+            _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+        track['duration'] = duration / timescale if timescale else 0
+    
+    tkhd = find_mp4_box(f, start, end, [b'tkhd'])
+    if tkhd:
+        f.seek(tkhd[0])
+        version = f.read(4)[0]
+        f.seek(tkhd[0] + (52 if version == 1 else 40))
+        a, b, _, c, d, _, _, _, _ = struct.unpack('>9i', f.read(36))
+        track['display_width'], track['display_height'] = (value / 65536 for value in struct.unpack('>II', f.read(8)))
+        # Clockwise rotation, the convention of the legacy 'rotate' tag and OpenCV's orientation
+        track['rotation'] = round(math.degrees(math.atan2(b, a))) % 360
+    
+    stsd = find_mp4_box(f, start, end, [b'mdia', b'minf', b'stbl', b'stsd'])
+    if stsd:
+        f.seek(stsd[0] + 12)
+        track['fourcc'] = f.read(4).decode('latin-1')
+        f.seek(stsd[0] + 16 + 24)
+        track['width'], track['height'] = struct.unpack('>HH', f.read(4))
+    
+    stsz = find_mp4_box(f, start, end, [b'mdia', b'minf', b'stbl', b'stsz'])
+    if stsz:
+        f.seek(stsz[0] + 8)
+        track['samples'] = struct.unpack('>I', f.read(4))[0]
+    return track
+
+def parse_mp4_header(video_path):
+    """
+    Read video information from the boxes of an MP4/MOV file without decoding
+    
+    Only box headers are read to find the moov box, wherever it is in the file.
+    
+    Returns:
+        dict: get_video_info fields, or None if the file has no usable video track
+    """
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        moov = find_mp4_box(f, 0, file_size, [b'moov'])
+        if moov is None:
+            return None
+        tracks = [parse_mp4_track(f, payload_start, box_end)
+                  for box_type, payload_start, box_end in read_mp4_boxes(f, *moov) if box_type == b'trak']
+    
+    video = next((track for track in tracks if track.get('handler') == 'vide'), None)
+    # Fragmented files keep their samples outside moov, so the header has no frame count
+    if video is None or not video.get('samples') or not video.get('duration') or 'width' not in video:
+        return None
+    
+    rotation = video.get('rotation', 0)
+    width, height = video['width'], video['height']
+    if rotation in (90, 270):
+        width, height = height, width
+    return {
+        'duration': video['duration'],
+        'fps': video['samples'] / video['duration'],
+        'width': width,
+        'height': height,
+        'total_frames': video['samples'],
+        'codec': MP4_CODECS.get(video.get('fourcc'), video.get('fourcc')),
+        'bitrate': int(file_size * 8 / video['duration']),
+        'rotation': rotation,
+        'has_audio': any(track.get('handler') == 'soun' for track in tracks),
+    }
+
+def read_ebml_varint(f, keep_marker=False):
+    """Read one EBML variable-length integer; element IDs keep their length marker"""
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    length = 1
+    while length <= 8 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML varint")
+    value = first[0] if keep_marker else first[0] & (0xFF >> length)
+    all_ones = value == (0xFF >> length)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    # A size of all ones means "unknown", as used for live-written segments
+    return None if all_ones and not keep_marker else value
+
+def read_ebml_elements(f, start, end):
+    """Yield (id, data_start, data_end) for each EBML element between two file offsets"""
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        try:
+            element_id = read_ebml_varint(f, keep_marker=True)
+            size = read_ebml_varint(f)
+        except (EOFError, ValueError):
+            return
+        data_start = f.tell()
+        data_end = end if size is None else data_start + size
+        yield element_id, data_start, data_end
+        offset = data_end
+
+def read_ebml_value(f, start, end, kind):
+    """Unsigned integer, float or string payload of an EBML element"""
+    f.seek(start)
+    data = f.read(end - start)
+    if kind == 'float':
+        return struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+    if kind == 'str':
+        return data.rstrip(b'\0').decode('latin-1')
+    return int.from_bytes(data, 'big')
+
+def parse_mkv_header(video_path):
+    """
+    Read video information from the EBML headers of a Matroska/WebM file without decoding
+    
+    Parsing stops at the first cluster, so no media data is read.
+    
+    Returns:
+        dict: get_video_info fields (total_frames derived from the default frame
+        duration), or None if the headers lack what is needed
+    """
+    timecode_scale, duration, tracks = 1000000, None, []
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        segment = next(((start, end) for element_id, start, end in read_ebml_elements(f, 0, file_size)
+                        if element_id == 0x18538067), None)
+        if segment is None:
+            return None
+        
+        for element_id, start, end in read_ebml_elements(f, *segment):
+            if element_id == 0x1F43B675:  # Cluster
+                break
+            if element_id == 0x1549A966:  # Info
+                for child_id, child_start, child_end in read_ebml_elements(f, start, end):
+                    if child_id == 0x2AD7B1:
+                        timecode_scale = read_ebml_value(f, child_start, child_end, 'int')
+                    elif child_id == 0x4489:
+                        duration = read_ebml_value(f, child_start, child_end, 'float')
+            elif element_id == 0x1654AE6B:  # Tracks
+                for entry_id, entry_start, entry_end in read_ebml_elements(f, start, end):
+                    if entry_id != 0xAE:
+                        continue
+                    track = {}
+                    for child_id, child_start, child_end in read_ebml_elements(f, entry_start, entry_end):
+                        if child_id == 0x83:
+                            track['type'] = read_ebml_value(f, child_start, child_end, 'int')
+                        elif child_id == 0x86:
+                            track['codec'] = read_ebml_value(f, child_start, child_end, 'str')
+                        elif child_id == 0x23E383:
+                            track['frame_duration'] = read_ebml_value(f, child_start, child_end, 'int') / 1e9
+                        elif child_id == 0xE0:
+                            for video_id, video_start, video_end in read_ebml_elements(f, child_start, child_end):
+                                if video_id == 0xB0:
+                                    track['width'] = read_ebml_value(f, video_start, video_end, 'int')
+                                elif video_id == 0xBA:
+                                    track['height'] = read_ebml_value(f, video_start, video_end, 'int')
+                    tracks.append(track)
+    
+    video = next((track for track in tracks if track.get('type') == 1), None)
+    if video is None or not duration or not video.get('frame_duration') or 'width' not in video:
+        return None
+    
+    duration_sec = duration * timecode_scale / 1e9
+    fps = 1 / video['frame_duration']
+    return {
+        'duration': duration_sec,
+        'fps': fps,
+        'width': video['width'],
+        'height': video['height'],
+        'total_frames': round(duration_sec * fps),
+        'codec': MKV_CODECS.get(video.get('codec'), video.get('codec')),
+        'bitrate': int(file_size * 8 / duration_sec),
+        'rotation': 0,
+        'has_audio': any(track.get('type') == 2 for track in tracks),
+    }
+
+def probe_with_ffprobe(video_path):
+    """Video information from ffprobe when it is installed; reads headers only"""
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', video_path],
+            capture_output=True, text=True
+        )
+        probe = json.loads(result.stdout)
+    except Exception:
+        return None
+    
+    streams = probe.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video is None:
+        return None
+    
+    fps = float(Fraction(video.get('avg_frame_rate') or '0/1')) if video.get('avg_frame_rate', '0/0') != '0/0' else 0
+    duration = float(video.get('duration') or probe.get('format', {}).get('duration') or 0)
+    rotation = 0
+    for side_data in video.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = round(-float(side_data['rotation'])) % 360
+    width, height = int(video.get('width', 0)), int(video.get('height', 0))
+    if rotation in (90, 270):
+        width, height = height, width
+    total_frames = int(video['nb_frames']) if video.get('nb_frames') else round(duration * fps)
+    return {
+        'duration': duration,
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'total_frames': total_frames,
+        'codec': video.get('codec_name'),
+        'bitrate': int(probe.get('format', {}).get('bit_rate') or 0),
+        'rotation': rotation,
+        'has_audio': any(stream.get('codec_type') == 'audio' for stream in streams),
+    }
+
+def probe_video_header(video_path):
+    """Video information from container headers: MP4/MOV boxes, Matroska EBML, else ffprobe"""
+    with open(video_path, 'rb') as f:
+        magic = f.read(12)
+    try:
+        if magic[:4] == b'\x1a\x45\xdf\xa3':
+            info = parse_mkv_header(video_path)
+        elif magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+            info = parse_mp4_header(video_path)
+        else:
+            info = None
+    except (OSError, struct.error, ValueError, EOFError):
+        info = None
+    return info or probe_with_ffprobe(video_path)
+
+def get_video_info(video_path, content_hash=None):
     """
-    Add thumbnail as an overlay on the video using OpenCV
-    
-    Args:
-        video_path (str): Path to input video file
-        thumbnail_path (str): Path to thumbnail image
-        output_path (str): Path for output video file
-        position (str): Position of thumbnail overlay
-        size_ratio (float): Size of thumbnail relative to video
-        duration_frames (int): How many frames to show thumbnail
+    Get basic video information, cached by content hash (or until the file changes)
     
     Returns:
-        bool: Success status
+        dict: duration, fps, width, height and total_frames plus codec, bitrate
+        (bits per second), rotation (degrees clockwise) and has_audio, or None
     """
+    return load_video_info(video_path, video_cache_key(video_path, content_hash))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_video_info(_video_path, cache_key):
+    """Video information with the exact frame count and duration from the packet index; only cache_key keys the cache"""
+    info = probe_video_info(_video_path)
+    if info is None:
+        return None
+    
+    try:
+        index = load_packet_index(_video_path, cache_key)
+    except Exception:
+        index = None
+    if index is not None and len(index['pts']):
+        pts = np.sort(index['pts'])
+        frame_duration = np.median(np.diff(pts)) if len(pts) > 1 else 0
+        info['total_frames'] = len(pts)
+        info['duration'] = float((pts[-1] - pts[0] + frame_duration) * index['time_base'])
+        if not info['fps'] and info['duration']:
+            info['fps'] = info['total_frames'] / info['duration']
+    return info
+
+def probe_video_info(video_path):
+    """Video information from the container headers, falling back to OpenCV"""
+    try:
+        info = probe_video_header(video_path)
+        if info is not None:
+            return info
+    except OSError:
+        return None
+    
     try:
-        # Open video
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
-            return False
+            return None
         
-        # Get video properties
         fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = frame_count / fps if fps > 0 else 0
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        # Load and resize thumbnail
-        thumbnail = cv2.imread(thumbnail_path)
-        if thumbnail is None:
-            # Try loading with PIL and convert
-            pil_img = Image.open(thumbnail_path)
-            thumbnail = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        
-        # Calculate thumbnail size
-        thumb_width = int(width * size_ratio)
-        thumb_height = int(thumb_width * thumbnail.shape[0] / thumbnail.shape[1])
-        thumbnail = cv2.resize(thumbnail, (thumb_width, thumb_height))
-        
-        # Calculate position
-        if position == 'top-right':
-            x, y = width - thumb_width - 20, 20
-        elif position == 'top-left':
-            x, y = 20, 20
-        elif position == 'bottom-right':
-            x, y = width - thumb_width - 20, height - thumb_height - 20
-        elif position == 'bottom-left':
-            x, y = 20, height - thumb_height - 20
-        else:  # center
-            x, y = (width - thumb_width) // 2, (height - thumb_height) // 2
-        
-        # Ensure coordinates are valid
-        x = max(0, min(x, width - thumb_width))
-        y = max(0, min(y, height - thumb_height))
-        
-        # Set up video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        frame_count = 0
-        
-        # Process each frame
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Add thumbnail overlay for the specified duration
-            if frame_count < duration_frames:
-                # Create a copy of the frame to modify
-                overlay_frame = frame.copy()
-                
-                # Add thumbnail with some transparency
-                alpha = 0.8  # Thumbnail opacity
-                
-                # Blend thumbnail with frame
-                roi = overlay_frame[y:y+thumb_height, x:x+thumb_width]
-                blended = cv2.addWeighted(roi, 1-alpha, thumbnail, alpha, 0)
-                overlay_frame[y:y+thumb_height, x:x+thumb_width] = blended
-                
-                out.write(overlay_frame)
-            else:
-                out.write(frame)
-            
-            frame_count += 1
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little').decode('latin-1').strip('\0 ')
+        bitrate = int(cap.get(cv2.CAP_PROP_BITRATE) * 1000)
+        rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META)) % 360
         
-        # Release everything
         cap.release()
-        out.release()
         
-        return True
-        
-    except Exception as e:
-        st.error(f"Error processing video: {str(e)}")
-        return False
+        return {
+            'duration': duration,
+            'fps': fps,
+            'width': width,
+            'height': height,
+            'total_frames': frame_count,
+            'codec': fourcc.lower() or None,
+            'bitrate': bitrate,
+            'rotation': rotation,
+            'has_audio': None
+        }
+    except:
+        return None
 
-def create_thumbnail_intro(video_path, thumbnail_path, output_path, intro_duration_sec=3):
+def detect_scenes(video_path, threshold=0.35, sample_fps=10, min_scene_sec=1.0, width=160):
     """
-    Create a video with thumbnail intro using OpenCV
+    Find scene starts with one streaming pass over downscaled HSV histograms
     
     Args:
         video_path (str): Path to input video file
-        thumbnail_path (str): Path to thumbnail image
-        output_path (str): Path for output video file
-        intro_duration_sec (int): Duration of intro in seconds
+        threshold (float): Histogram distance (0-1) between consecutive samples that counts as a cut
+        sample_fps (float): Frames compared per second of video
+        min_scene_sec (float): Shortest scene; cuts closer than this to the previous one are ignored
+        width (int): Width frames are compared at
     
     Returns:
-        bool: Success status
+        list: dicts with the frame_index and timestamp of each scene's first sampled frame,
+        starting with the first frame of the video
     """
     try:
-        # Open video to get properties
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return False
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        # Load thumbnail
-        thumbnail = cv2.imread(thumbnail_path)
-        if thumbnail is None:
-            # Try loading with PIL and convert
-            pil_img = Image.open(thumbnail_path)
-            thumbnail = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        
-        # Resize thumbnail to match video dimensions
-        thumbnail = cv2.resize(thumbnail, (width, height))
-        
-        # Set up video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        index = get_keyframe_index(video_path)
+    except Exception:
+        index = None
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    
+    def timestamp(frame_index):
+        if index is not None and frame_index < len(index['timestamps']):
+            return float(index['timestamps'][frame_index])
+        return frame_index / fps
+    
+    scenes = []
+    previous = None
+    for frame_index, frame in sample_video_frames(video_path, sample_fps, width):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        histogram = cv2.calcHist([hsv], [0, 1, 2], None, [16, 4, 4], [0, 180, 0, 256, 0, 256]).ravel()
+        histogram /= max(histogram.sum(), 1)
+        if previous is None:
+            scenes.append({'frame_index': frame_index, 'timestamp': timestamp(frame_index)})
+        elif (0.5 * np.abs(histogram - previous).sum() > threshold
+              and frame_index - scenes[-1]['frame_index'] >= min_scene_sec * fps):
+            scenes.append({'frame_index': frame_index, 'timestamp': timestamp(frame_index)})
+        previous = histogram
+    return scenes
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_scene_starts(video_path, size, mtime_ns, threshold=0.35):
+    """detect_scenes result; size and mtime key the cache like load_video_info"""
+    return detect_scenes(video_path, threshold)
+
+def get_scene_starts(video_path, threshold=0.35):
+    """Cached scene starts of a video, rebuilt when the file changes"""
+    stat = os.stat(video_path)
+    return load_scene_starts(video_path, stat.st_size, stat.st_mtime_ns, threshold)
+
+def encoder_settings(key):
+    """Widgets choosing the encoder backend for full re-encodes; returns settings for open_video_writer"""
+    backends = available_encoders()
+    backend = st.selectbox(
+        "Encoder",
+        options=backends,
+        format_func=lambda name: ENCODER_BACKENDS[name],
+        index=backends.index('ffmpeg') if 'ffmpeg' in backends else 0,
+        key=f"{key}_encoder",
+        help="H.264 backends give much smaller files than OpenCV's MPEG-4 writer"
+    )
+    if backend == 'opencv':
+        return None
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        preset = st.selectbox("Preset", options=X264_PRESETS, index=X264_PRESETS.index('veryfast'),
+                              key=f"{key}_preset", help="Faster presets encode quicker but give larger files")
+    with col2:
+        crf = st.slider("Quality (CRF)", min_value=14, max_value=35, value=23, key=f"{key}_crf",
+                        help="Lower is better quality and larger files")
+    return {'backend': backend, 'preset': preset, 'crf': crf}
+
+def variants_mode():
+    """Render several thumbnail variants of one video for A/B testing"""
+    st.subheader("🧪 Thumbnail Variants")
+    st.write("Render every thumbnail (and overlay position) against one video in a single pass")
+    
+    video_file = st.file_uploader(
+        "Choose a video file",
+        type=VIDEO_EXTENSIONS,
+        help="Supported formats: MP4, AVI, MOV, MKV"
+    )
+    thumbnail_files = st.file_uploader(
+        "Choose thumbnail images",
+        type=['jpg', 'jpeg', 'png', 'bmp'],
+        accept_multiple_files=True,
+        help="Upload every thumbnail you want to compare"
+    )
+    
+    if video_file is None or not thumbnail_files:
+        st.info("📹 Upload a video and at least one thumbnail to get started.")
+        return
+    
+    # The video and thumbnails are written to disk once per content and shared across reruns and sessions
+    with contextlib.ExitStack() as uploads:
+        video_path, video_hash = uploads.enter_context(stored_upload(video_file))
+        thumbnails = [uploads.enter_context(stored_upload(thumbnail_file)) for thumbnail_file in thumbnail_files]
+        thumbnail_paths = [path for path, _ in thumbnails]
         
-        # Write intro frames (thumbnail)
-        intro_frames = int(fps * intro_duration_sec)
-        for _ in range(intro_frames):
-            out.write(thumbnail)
+        video_info = get_video_info(video_path, video_hash)
         
-        # Write original video frames
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Reset to beginning
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            out.write(frame)
+        variant_mode = st.radio("Variant type:", options=["Intro Screen", "Overlay"], horizontal=True)
         
-        # Release everything
-        cap.release()
-        out.release()
+        if variant_mode == "Intro Screen":
+            intro_duration = st.slider("Intro Duration (seconds)", min_value=1, max_value=10, value=3)
+            settings = [{'mode': 'intro', 'intro_duration_sec': intro_duration}]
+        else:
+            positions = st.multiselect(
+                "Overlay Positions",
+                options=['top-right', 'top-left', 'bottom-right', 'bottom-left', 'center'],
+                default=['top-right'],
+                help="Every thumbnail is rendered at each selected position"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                overlay_size = st.slider("Overlay Size (%)", min_value=10, max_value=40, value=20)
+            with col2:
+                overlay_duration = st.slider(
+                    "Overlay Duration (seconds)",
+                    min_value=1,
+                    max_value=min(15, int(video_info['duration']) if video_info else 15),
+                    value=5
+                )
+            duration_frames = frames_until(video_path, overlay_duration, video_hash)
+            settings = [
+                {'mode': 'overlay', 'position': position, 'size_ratio': overlay_size / 100, 'duration_frames': duration_frames}
+                for position in positions
+            ]
         
-        return True
+        variants = []
+        for thumbnail_file, thumbnail_path in zip(thumbnail_files, thumbnail_paths):
+            for setting in settings:
+                label = thumbnail_file.name if setting['mode'] == 'intro' else f"{thumbnail_file.name} @ {setting['position']}"
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_output:
+                    output_path = tmp_output.name
+                variants.append(dict(setting, thumbnail_path=thumbnail_path, output_path=output_path, label=label))
         
-    except Exception as e:
-        st.error(f"Error creating intro video: {str(e)}")
-        return False
-
-def extract_thumbnail_from_video(video_path, position=0.1):
-    """Extract a frame from video as thumbnail"""
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None
+        with st.expander("🚀 Performance"):
+            encoder = encoder_settings("variants")
         
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_number = int(total_frames * position)
+        st.write(f"**{len(variants)} variant(s)** will be rendered from a single decode")
         
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-        ret, frame = cap.read()
-        cap.release()
+        render_key = job_key([video_hash] + [content_hash for _, content_hash in thumbnails], [settings, encoder])
+        job = find_finished_job(render_key)
         
-        if ret:
-            # Convert BGR to RGB for PIL
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            return Image.fromarray(frame_rgb)
+        if variants and st.button("🧪 Render Variants", type="primary") and job is None:
+            pipeline_stats = {}
+            with st.spinner(f"Rendering {len(variants)} variants..."):
+                try:
+                    success = render_thumbnail_variants(video_path, variants, stats=pipeline_stats, encoder=encoder)
+                except Exception as e:
+                    success = False
+                    st.error(f"Error rendering thumbnail variants: {str(e)}")
+            
+            if success:
+                job = register_finished_job(
+                    render_key,
+                    [{'output_path': variant['output_path'], 'label': variant['label']} for variant in variants],
+                    frames=pipeline_stats['frames']
+                )
+            else:
+                st.error("❌ Failed to render variants. Please try a different video format.")
         
-        return None
+        # Kept across reruns, including the ones clicking a download button causes
+        if job is not None:
+            st.success(f"🎉 Rendered {len(job['outputs'])} variants from {job['frames']:,} decoded frames")
+            for k, output in enumerate(job['outputs']):
+                download_output(output['key'], f"💾 Download {output['label']}",
+                                f"variant_{k + 1}_{video_file.name.rsplit('.', 1)[0]}.mp4", button_key=f"variant_{k}")
         
-    except:
-        return None
+        # Clean up temporary files; the store keeps the thumbnails
+        try:
+            for variant in variants:
+                if os.path.exists(variant['output_path']):
+                    os.unlink(variant['output_path'])
+        except OSError:
+            pass
 
-def get_video_info(video_path):
-    """Get basic video information using OpenCV"""
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        cap.release()
+def batch_mode():
+    """Apply one thumbnail to many videos on a pool of worker processes"""
+    st.subheader("📦 Batch Processing")
+    st.write("Brand a whole series of videos with the same thumbnail and settings")
+    
+    source = st.radio("Videos from:", options=["Upload files", "Server directory"], horizontal=True)
+    
+    video_files = []
+    video_paths = []
+    output_dir = None
+    if source == "Upload files":
+        video_files = st.file_uploader(
+            "Choose video files",
+            type=VIDEO_EXTENSIONS,
+            accept_multiple_files=True,
+            help="Supported formats: MP4, AVI, MOV, MKV"
+        ) or []
+    else:
+        directory = st.text_input("Directory on the server", help="Every video file directly inside it is processed")
+        if directory:
+            if os.path.isdir(directory):
+                video_paths = sorted(
+                    os.path.join(directory, name) for name in os.listdir(directory)
+                    if name.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS
+                )
+                output_dir = os.path.join(directory, 'thumbnailed')
+                st.write(f"📁 Found {len(video_paths)} video(s); results are saved to `{output_dir}`")
+            else:
+                st.error("❌ Directory not found")
+    
+    thumbnail_file = st.file_uploader(
+        "Choose a thumbnail image",
+        type=['jpg', 'jpeg', 'png', 'bmp'],
+        help="Supported formats: JPG, PNG, BMP"
+    )
+    
+    batch_mode_choice = st.radio("Thumbnail mode:", options=["Intro Screen", "Overlay", "Cover Art"], horizontal=True)
+    settings = {}
+    if batch_mode_choice == "Intro Screen":
+        settings['mode'] = 'intro'
+        settings['intro_duration_sec'] = st.slider("Intro Duration (seconds)", min_value=1, max_value=10, value=3)
+    elif batch_mode_choice == "Cover Art":
+        settings['mode'] = 'cover'
+    else:
+        settings['mode'] = 'overlay'
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            settings['position'] = st.selectbox(
+                "Overlay Position",
+                options=['top-right', 'top-left', 'bottom-right', 'bottom-left', 'center']
+            )
+        with col2:
+            settings['size_ratio'] = st.slider("Overlay Size (%)", min_value=10, max_value=40, value=20) / 100
+        with col3:
+            settings['overlay_duration_sec'] = st.slider("Overlay Duration (seconds)", min_value=1, max_value=15, value=5)
+    
+    settings['encoder'] = encoder_settings("batch")
+    
+    cpu_count = os.cpu_count() or 1
+    workers = st.slider(
+        "Worker Processes",
+        min_value=1,
+        max_value=max(2, cpu_count),
+        value=cpu_count,
+        help="Videos rendered at the same time (never more than the CPU count); OpenCV threads are split between them"
+    )
+    
+    # A batch that already ran with these videos, thumbnail and settings is shown again instead of re-rendered
+    job = None
+    upload_hashes = [get_upload_store().known_hash(video_file) for video_file in video_files]
+    if thumbnail_file is not None and None not in upload_hashes:
+        job = find_finished_job(batch_job_key(upload_hashes, video_paths, thumbnail_file, settings, output_dir))
+    
+    ready = (video_files or video_paths) and thumbnail_file is not None
+    if ready and st.button("📦 Process Batch", type="primary") and (job is None or job['succeeded'] < len(job['results'])):
+        # Uploads are written to the shared store only once the batch runs, and held until it is done
+        with contextlib.ExitStack() as uploads:
+            stored = [uploads.enter_context(stored_upload(video_file)) for video_file in video_files]
+            thumbnail_path, _ = uploads.enter_context(stored_upload(thumbnail_file))
+            sources = [(path, video_file.name) for (path, _), video_file in zip(stored, video_files)]
+            sources += [(video_path, os.path.basename(video_path)) for video_path in video_paths]
+            render_key = batch_job_key([content_hash for _, content_hash in stored], video_paths, thumbnail_file,
+                                       settings, output_dir)
+            
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            
+            jobs = []
+            names = {}
+            stems = Counter(os.path.splitext(name)[0] for _, name in sources)
+            for video_path, name in sources:
+                if output_dir:
+                    # Videos that differ only in extension (ep1.mov, ep1.mkv) keep it, so their outputs don't collide
+                    stem, extension = os.path.splitext(name)
+                    if stems[stem] > 1:
+                        stem += '_' + extension.lstrip('.')
+                    output_path = os.path.join(output_dir, f"{stem}.mp4")
+                else:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_output:
+                        output_path = tmp_output.name
+                names[output_path] = name
+                jobs.append(dict(settings, video_path=video_path, thumbnail_path=thumbnail_path, output_path=output_path))
+            
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            status_text.text(f"📦 Processing {len(jobs)} videos...")
+            
+            # Results arrive as each worker finishes
+            results = []
+            succeeded = 0
+            for done, result in enumerate(run_batch(jobs, workers), start=1):
+                progress_bar.progress(done / len(jobs))
+                status_text.text(f"📦 {done}/{len(jobs)} videos done")
+                
+                row = {'name': names[result['output_path']], 'success': result['success'],
+                       'seconds': result['seconds'], 'error': result.get('error'),
+                       'warnings': result.get('warnings', [])}
+                if result['success']:
+                    succeeded += 1
+                    if output_dir:
+                        row['output_path'] = result['output_path']
+                    else:
+                        row['key'] = publish_output(result['output_path'])
+                results.append(row)
+                batch_result_row(row)
+            
+            status_text.text(f"✅ {succeeded}/{len(jobs)} videos processed successfully")
+            register_finished_job(render_key, [row for row in results if 'key' in row],
+                                  results=results, succeeded=succeeded)
+            
+            # Clean up temporary files; the store keeps the uploads
+            try:
+                if not output_dir:
+                    for job in jobs:
+                        if os.path.exists(job['output_path']):
+                            os.unlink(job['output_path'])
+            except OSError:
+                pass
+    
+    elif job is not None:
+        st.write(f"✅ {job['succeeded']}/{len(job['results'])} videos processed successfully")
+        for row in job['results']:
+            batch_result_row(row)
+
+def batch_job_key(upload_hashes, video_paths, thumbnail_file, settings, output_dir):
+    """Job key of a batch: uploaded videos by content, server videos by path, size and mtime, plus the thumbnail and settings"""
+    inputs = upload_hashes + [video_cache_key(path) for path in video_paths]
+    inputs.append(hashlib.sha256(thumbnail_file.getvalue()).hexdigest())
+    return job_key(inputs, [settings, output_dir])
+
+def batch_result_row(row):
+    """One video of a batch: where it was saved, its download, or why it failed, after any render warnings"""
+    for message in row['warnings']:
+        st.caption(f"{message} ({row['name']})")
+    if not row['success']:
+        st.write(f"❌ {row['name']} failed{': ' + row['error'] if row['error'] else ''}")
+    elif 'key' in row:
+        download_output(row['key'], f"💾 {row['name']} ({row['seconds']:.1f}s)",
+                        f"thumbnail_{row['name'].replace('.', '_')}.mp4", button_key=f"batch_{row['key']}")
+    else:
+        st.write(f"✅ {row['name']} → `{row['output_path']}` ({row['seconds']:.1f}s)")
+
+def multi_frame_extract(video_path, video_name, seek_mode):
+    """Extract evenly spaced frames in one pass and show them as a contact sheet or individually"""
+    col1, col2 = st.columns(2)
+    with col1:
+        frame_count = st.slider("Number of frames", min_value=2, max_value=50, value=12,
+                                help="Frames are spaced evenly across the video")
+    with col2:
+        output = st.radio("Show as", ["Contact sheet", "Individual frames"], horizontal=True)
+    skip_duplicates = st.checkbox("Skip near-duplicate frames", value=True,
+                                  help="Frames whose perceptual hashes nearly match an earlier frame are left out")
+    
+    if not st.button("🎞️ Extract Frames", type="primary"):
+        return
+    
+    with st.spinner(f"Extracting {frame_count} frames..."):
+        start = time.perf_counter()
+        frames = extract_frames(video_path, count=frame_count, seek=seek_mode)
+        extracted = len(frames)
+        if skip_duplicates:
+            frames = dedupe_frames(frames)
+        elapsed = time.perf_counter() - start
+    if not frames:
+        st.error("❌ Failed to extract frames")
+        return
+    
+    st.success(f"✅ Extracted {extracted} frames in {elapsed:.1f}s")
+    if len(frames) < extracted:
+        st.info(f"Skipped {extracted - len(frames)} near-duplicate frames")
+    base_name = video_name.rsplit('.', 1)[0]
+    if output == "Contact sheet":
+        sheet = build_contact_sheet(frames, columns=4)
+        st.image(sheet, caption=f"Contact sheet of {video_name}")
         
-        return {
-            'duration': duration,
-            'fps': fps,
-            'width': width,
-            'height': height,
-            'total_frames': frame_count
-        }
-    except:
-        return None
+        img_buffer = io.BytesIO()
+        sheet.save(img_buffer, format='PNG')
+        st.download_button(
+            label="💾 Download Contact Sheet",
+            data=img_buffer.getvalue(),
+            file_name=f"contact_sheet_{base_name}.png",
+            mime="image/png"
+        )
+        return
+    
+    frame_grid(frames, base_name, key="frames")
+
+def frame_grid(frames, base_name, key, captions=None, columns=4):
+    """Show extracted frames in a grid, each with its own PNG download"""
+    grid = st.columns(columns)
+    for k, result in enumerate(frames):
+        image = Image.fromarray(cv2.cvtColor(result['frame'], cv2.COLOR_BGR2RGB))
+        img_buffer = io.BytesIO()
+        image.save(img_buffer, format='PNG')
+        caption = captions[k] if captions else f"Frame {result['frame_index']} at {result['timestamp']:.2f}s"
+        with grid[k % columns]:
+            st.image(image, caption=caption)
+            st.download_button(
+                label="💾 Download",
+                data=img_buffer.getvalue(),
+                file_name=f"thumbnail_{base_name}_{result['frame_index']}.png",
+                mime="image/png",
+                key=f"{key}_download_{result['frame_index']}"
+            )
+
+def auto_pick_extract(video_path, video_name):
+    """Score sampled frames and show the best non-duplicate thumbnail candidates"""
+    face_cascade_available = load_face_cascade() is not None
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        candidate_count = st.slider("Candidates", min_value=1, max_value=12, value=4)
+    with col2:
+        sample_fps = st.select_slider("Samples per second", options=[0.5, 1, 2, 4, 8], value=2,
+                                      help="More samples find brief moments but take longer")
+    with col3:
+        detect_faces = st.checkbox("Prefer faces", value=face_cascade_available, disabled=not face_cascade_available,
+                                   help="Uses OpenCV's bundled Haar cascade" if face_cascade_available
+                                   else "This OpenCV build ships without Haar cascades")
+    
+    if not st.button("✨ Auto-pick Thumbnails", type="primary"):
+        return
+    
+    with st.spinner("Scoring frames..."):
+        start = time.perf_counter()
+        candidates = auto_pick_thumbnails(video_path, count=candidate_count, sample_fps=sample_fps,
+                                          detect_faces=detect_faces)
+        elapsed = time.perf_counter() - start
+    if not candidates:
+        st.error("❌ Failed to score frames")
+        return
+    
+    st.success(f"✅ Picked {len(candidates)} candidates in {elapsed:.1f}s")
+    captions = [f"#{rank} · score {result['score']:.2f} · {result['timestamp']:.2f}s"
+                + (f" · +{result['duplicates']} similar" if result['duplicates'] else "")
+                for rank, result in enumerate(candidates, 1)]
+    frame_grid(candidates, video_name.rsplit('.', 1)[0], key="auto_pick", captions=captions)
 
 def main():
     st.title("🎬 Video Thumbnail Creator")
@@ -221,7 +3695,7 @@ def main():
     st.sidebar.title("🎯 Mode Selection")
     mode = st.sidebar.radio(
         "Choose what you want to do:",
-        ["Add Custom Thumbnail", "Extract Thumbnail from Video"]
+        ["Add Custom Thumbnail", "Thumbnail Variants (A/B)", "Batch Processing", "Extract Thumbnail from Video"]
     )
     
     if mode == "Add Custom Thumbnail":
@@ -260,162 +3734,181 @@ def main():
                 st.write(f"📁 Name: {thumbnail_file.name}")
                 st.write(f"📊 Size: {thumbnail_file.size / 1024:.2f} KB")
             
-            # Save files to temporary locations
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{video_file.name.split('.')[-1]}") as tmp_video:
-                tmp_video.write(video_file.read())
-                video_path = tmp_video.name
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{thumbnail_file.name.split('.')[-1]}") as tmp_thumb:
-                tmp_thumb.write(thumbnail_file.read())
-                thumbnail_path = tmp_thumb.name
-            
-            # Display thumbnail preview
-            thumbnail_image = Image.open(thumbnail_path)
-            st.image(thumbnail_image, caption="Thumbnail Preview", width=200)
-            
-            # Get video information
-            video_info = get_video_info(video_path)
-            if video_info:
-                st.subheader("📊 Video Details")
-                info_col1, info_col2 = st.columns(2)
+            # Written to disk once per content and shared across reruns, sessions and background jobs
+            with stored_upload(video_file) as (video_path, video_hash), stored_upload(thumbnail_file) as (thumbnail_path, thumbnail_hash):
+                # Display thumbnail preview
+                thumbnail_image = Image.open(thumbnail_path)
+                st.image(thumbnail_image, caption="Thumbnail Preview", width=200)
                 
-                with info_col1:
-                    st.metric("Duration", f"{video_info['duration']:.1f}s")
-                    st.metric("FPS", f"{video_info['fps']:.1f}")
+                # Get video information
+                video_info = get_video_info(video_path, video_hash)
+                if video_info:
+                    st.subheader("📊 Video Details")
+                    info_col1, info_col2 = st.columns(2)
+                    
+                    with info_col1:
+                        st.metric("Duration", f"{video_info['duration']:.1f}s")
+                        st.metric("FPS", f"{video_info['fps']:.1f}")
+                    
+                    with info_col2:
+                        st.metric("Resolution", f"{video_info['width']}x{video_info['height']}")
+                        st.metric("Total Frames", f"{video_info['total_frames']:,}")
                 
-                with info_col2:
-                    st.metric("Resolution", f"{video_info['width']}x{video_info['height']}")
-                    st.metric("Total Frames", f"{video_info['total_frames']:,}")
-            
-            # Settings
-            st.subheader("⚙️ Thumbnail Settings")
-            
-            thumbnail_mode = st.radio(
-                "Choose how to add your thumbnail:",
-                options=["Intro Screen", "Overlay"],
-                help="Intro Screen: Shows thumbnail before video starts\nOverlay: Shows thumbnail as overlay during video"
-            )
-            
-            if thumbnail_mode == "Intro Screen":
-                intro_duration = st.slider(
-                    "Intro Duration (seconds)",
-                    min_value=1,
-                    max_value=10,
-                    value=3,
-                    help="How long to show the thumbnail before the video starts"
+                # Settings
+                st.subheader("⚙️ Thumbnail Settings")
+                
+                thumbnail_mode = st.radio(
+                    "Choose how to add your thumbnail:",
+                    options=["Intro Screen", "Overlay", "Cover Art"],
+                    help="Intro Screen: Shows thumbnail before video starts\nOverlay: Shows thumbnail as overlay during video\nCover Art: Embeds thumbnail as the file's cover image without re-encoding"
                 )
-            else:  # Overlay mode
-                col1, col2, col3 = st.columns(3)
                 
-                with col1:
-                    overlay_position = st.selectbox(
-                        "Overlay Position",
-                        options=['top-right', 'top-left', 'bottom-right', 'bottom-left', 'center'],
-                        index=0
+                if thumbnail_mode == "Intro Screen":
+                    intro_duration = st.slider(
+                        "Intro Duration (seconds)",
+                        min_value=1,
+                        max_value=10,
+                        value=3,
+                        help="How long to show the thumbnail before the video starts"
                     )
-                
-                with col2:
-                    overlay_size = st.slider(
-                        "Overlay Size (%)",
-                        min_value=10,
-                        max_value=40,
-                        value=20,
-                        help="Size of overlay relative to video width"
+                    
+                    stream_copy = st.checkbox(
+                        "⚡ Copy original stream",
+                        value=True,
+                        help="Only encode the intro and copy the original video unchanged"
                     )
-                
-                with col3:
-                    overlay_duration = st.slider(
-                        "Overlay Duration (seconds)",
-                        min_value=1,
-                        max_value=min(15, int(video_info['duration']) if video_info else 15),
-                        value=5,
-                        help="How long to show the overlay from the start"
+                elif thumbnail_mode == "Cover Art":
+                    st.caption("The video and audio streams are copied as-is, so this takes about as long as copying the file.")
+                else:  # Overlay mode
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        overlay_position = st.selectbox(
+                            "Overlay Position",
+                            options=['top-right', 'top-left', 'bottom-right', 'bottom-left', 'center'],
+                            index=0
+                        )
+                    
+                    with col2:
+                        overlay_size = st.slider(
+                            "Overlay Size (%)",
+                            min_value=10,
+                            max_value=40,
+                            value=20,
+                            help="Size of overlay relative to video width"
+                        )
+                    
+                    with col3:
+                        overlay_duration = st.slider(
+                            "Overlay Duration (seconds)",
+                            min_value=1,
+                            max_value=min(15, int(video_info['duration']) if video_info else 15),
+                            value=5,
+                            help="How long to show the overlay from the start"
+                        )
+                    
+                    smart_render = st.checkbox(
+                        "⚡ Smart render",
+                        value=True,
+                        help="Only re-encode the part of the video the overlay touches and copy the rest unchanged"
                     )
-            
-            # Process video button
-            if st.button("🎬 Create Video with Thumbnail", type="primary"):
-                
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                status_text.text("🎬 Processing video... Please wait")
-                progress_bar.progress(25)
                 
-                try:
-                    # Create output file
-                    output_filename = f"thumbnail_{video_file.name.replace('.', '_')}.mp4"
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_output:
-                        output_path = tmp_output.name
+                with st.expander("🚀 Performance"):
+                    perf_col1, perf_col2 = st.columns(2)
                     
-                    progress_bar.progress(50)
+                    with perf_col1:
+                        queue_depth = st.slider(
+                            "Queue Depth (frames)",
+                            min_value=1,
+                            max_value=64,
+                            value=8,
+                            help="Frames buffered between the decode, composite and encode stages"
+                        )
                     
-                    # Process video based on selected mode
-                    if thumbnail_mode == "Intro Screen":
-                        status_text.text("📽️ Adding intro thumbnail...")
-                        success = create_thumbnail_intro(video_path, thumbnail_path, output_path, intro_duration)
-                    else:
-                        status_text.text("🎯 Adding thumbnail overlay...")
-                        duration_frames = int(video_info['fps'] * overlay_duration) if video_info else 150
-                        success = add_thumbnail_overlay(
-                            video_path, 
-                            thumbnail_path, 
-                            output_path, 
-                            overlay_position, 
-                            overlay_size/100,
-                            duration_frames
+                    with perf_col2:
+                        pipeline_threads = st.slider(
+                            "Compositor Threads",
+                            min_value=1,
+                            max_value=max(2, os.cpu_count() or 1),
+                            value=min(2, os.cpu_count() or 1),
+                            help="Threads blending thumbnails into frames"
                         )
                     
-                    progress_bar.progress(75)
+                    parallel_segments = st.slider(
+                        "Parallel Segments",
+                        min_value=1,
+                        max_value=max(2, os.cpu_count() or 1),
+                        value=1,
+                        help="Cut the video at keyframes and render the pieces in separate processes (used when the video has to be fully re-encoded)"
+                    )
                     
-                    if success and os.path.exists(output_path):
-                        progress_bar.progress(100)
-                        status_text.text("✅ Video processed successfully!")
-                        
-                        # Get file size
-                        output_size = os.path.getsize(output_path)
-                        st.success(f"🎉 Video created! Size: {output_size / (1024*1024):.2f} MB")
-                        
-                        # Read processed video for download
-                        with open(output_path, 'rb') as f:
-                            video_bytes = f.read()
-                        
-                        # Download button
-                        st.download_button(
-                            label="💾 Download Video with Thumbnail",
-                            data=video_bytes,
-                            file_name=output_filename,
-                            mime="video/mp4"
-                        )
-                        
-                        # Clean up output file
-                        try:
-                            os.unlink(output_path)
-                        except:
-                            pass
-                        
-                    else:
-                        progress_bar.progress(0)
-                        status_text.text("❌ Processing failed")
-                        st.error("❌ Failed to process video. Please try a different video format.")
+                    encoder = encoder_settings("single")
                 
-                except Exception as e:
-                    progress_bar.progress(0)
-                    status_text.text("❌ Processing failed")
-                    st.error(f"Error processing video: {str(e)}")
-            
-            # Clean up temporary files
-            try:
-                for path in [video_path, thumbnail_path]:
-                    if os.path.exists(path):
-                        os.unlink(path)
-            except:
-                pass
+                # Everything that changes the output; queue depth, threads and segments only change the speed
+                if thumbnail_mode == "Intro Screen":
+                    params = {'mode': 'intro', 'intro_duration': intro_duration, 'stream_copy': stream_copy, 'encoder': encoder}
+                elif thumbnail_mode == "Cover Art":
+                    params = {'mode': 'cover'}
+                else:
+                    params = {'mode': 'overlay', 'position': overlay_position, 'size': overlay_size,
+                              'duration': overlay_duration, 'smart_render': smart_render, 'encoder': encoder}
+                render_key = job_key([video_hash, thumbnail_hash], params)
+                session_jobs()
+                job = find_finished_job(render_key)
+                
+                # Process video button; a finished or running render with the same inputs and settings is shown instead
+                runner = get_job_runner()
+                if st.button("🎬 Create Video with Thumbnail", type="primary") and job is None and runner.find(render_key) is None:
+                    options = {'file_name': f"thumbnail_{video_file.name.replace('.', '_')}.mp4", 'queue_depth': queue_depth,
+                               'threads': pipeline_threads, 'segments': parallel_segments}
+                    if params['mode'] == 'overlay':
+                        options['duration_frames'] = frames_until(video_path, overlay_duration, video_hash)
+                    
+                    # The job holds its own references to the inputs, since it outlives this script run
+                    store = get_upload_store()
+                    for path in (video_path, thumbnail_path):
+                        store.retain(path)
+                    track_job(runner.submit(
+                        render_thumbnail_job, video_path, thumbnail_path, params, options,
+                        key=render_key,
+                        label=f"{video_file.name} · {thumbnail_mode}",
+                        total_frames=expected_job_frames(video_path, params, options, video_hash),
+                        cleanup=[functools.partial(store.release, path) for path in (video_path, thumbnail_path)]
+                    ))
+                
+                # Jobs keep running when the page reruns, reloads or the user looks elsewhere
+                render_jobs(render_key)
+                
+                # Kept across reruns, including the one clicking the download button causes
+                if job is not None:
+                    output = job['outputs'][0]
+                    st.success(f"🎉 Video created! Size: {output['size'] / (1024*1024):.2f} MB")
+                    
+                    if job['stats']:
+                        with st.expander("⏱️ Pipeline Stats"):
+                            st.write(f"Frames processed: {job['stats']['frames']:,}")
+                            st.table({
+                                stage.capitalize(): {
+                                    'Busy (s)': f"{job['stats'][stage]['busy']:.2f}",
+                                    'Stalled (s)': f"{job['stats'][stage]['stall']:.2f}"
+                                }
+                                for stage in ('decode', 'composite', 'encode')
+                            })
+                    
+                    # Served from disk, so the video isn't held in memory for the download
+                    download_output(output['key'], "💾 Download Video with Thumbnail", job['file_name'])
         
         elif video_file is not None:
             st.info("📹 Video uploaded. Please also upload a thumbnail image.")
         elif thumbnail_file is not None:
             st.info("🖼️ Thumbnail uploaded. Please also upload a video file.")
     
+    elif mode == "Thumbnail Variants (A/B)":
+        variants_mode()
+    
+    elif mode == "Batch Processing":
+        batch_mode()
+    
     else:  # Extract Thumbnail mode
         st.subheader("📹 Extract Thumbnail from Video")
         
@@ -428,55 +3921,107 @@ def main():
         if video_file is not None:
             st.success(f"✅ Video uploaded: {video_file.name}")
             
-            # Save video to temporary location
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{video_file.name.split('.')[-1]}") as tmp_video:
-                tmp_video.write(video_file.read())
-                video_path = tmp_video.name
-            
-            # Get video info
-            video_info = get_video_info(video_path)
-            if video_info:
-                st.write(f"📊 Duration: {video_info['duration']:.1f}s | Resolution: {video_info['width']}x{video_info['height']}")
-                
-                # Frame position selector
-                frame_position = st.slider(
-                    "Select frame position to extract",
-                    min_value=0.0,
-                    max_value=1.0,
-                    value=0.5,
-                    step=0.05,
-                    help="0.0 = start, 0.5 = middle, 1.0 = end"
-                )
-                
-                if st.button("🖼️ Extract Thumbnail", type="primary"):
-                    with st.spinner("Extracting thumbnail..."):
-                        thumbnail = extract_thumbnail_from_video(video_path, frame_position)
-                        
-                        if thumbnail:
-                            st.success("✅ Thumbnail extracted!")
-                            st.image(thumbnail, caption=f"Extracted from {video_file.name}", width=400)
-                            
-                            # Convert to bytes for download
-                            img_buffer = io.BytesIO()
-                            thumbnail.save(img_buffer, format='PNG')
-                            img_bytes = img_buffer.getvalue()
-                            
-                            # Download button
-                            filename = f"thumbnail_{video_file.name.split('.')[0]}.png"
-                            st.download_button(
-                                label="💾 Download Thumbnail",
-                                data=img_bytes,
-                                file_name=filename,
-                                mime="image/png"
+            # Written to disk once per content and shared across reruns and sessions
+            with stored_upload(video_file) as (video_path, video_hash):
+                # Get video info
+                video_info = get_video_info(video_path, video_hash)
+                if video_info:
+                    st.write(f"📊 Duration: {video_info['duration']:.1f}s | Resolution: {video_info['width']}x{video_info['height']}")
+                    details = [video_info['codec'] and video_info['codec'].upper(),
+                               video_info['bitrate'] and f"{video_info['bitrate'] / 1e6:.1f} Mbit/s",
+                               video_info['rotation'] and f"rotated {video_info['rotation']}°",
+                               {True: "with audio", False: "no audio"}.get(video_info['has_audio'])]
+                    st.caption(" · ".join(detail for detail in details if detail))
+                    
+                    # Low-resolution keyframe previews are built once per video in the background
+                    preview_proxy = start_preview_proxy(video_path, video_hash)
+                    
+                    extraction = st.radio(
+                        "Extract",
+                        ["Single frame", "Multiple frames", "Auto-pick best"],
+                        horizontal=True,
+                        help="Multiple frames are decoded in one pass and can be tiled into a contact sheet; "
+                             "Auto-pick scores frames for sharpness, exposure and color"
+                    )
+                    
+                    if extraction != "Auto-pick best":
+                        seek_mode = st.radio(
+                            "Seek mode",
+                            options=list(SEEK_MODES),
+                            format_func=lambda name: SEEK_MODES[name],
+                            index=list(SEEK_MODES).index('accurate'),
+                            horizontal=True,
+                            help="Fast returns the nearest keyframe almost instantly; Accurate decodes forward to the exact frame"
+                        )
+                    
+                    if extraction == "Auto-pick best":
+                        auto_pick_extract(video_path, video_file.name)
+                        frame_position = None
+                    elif extraction == "Multiple frames":
+                        multi_frame_extract(video_path, video_file.name, seek_mode)
+                        frame_position = None
+                    else:
+                        frame_index = None
+                        if st.checkbox("🎬 Jump to scene", help="Scene cuts are detected once per video and cached"):
+                            with st.spinner("Detecting scenes..."):
+                                scenes = get_scene_starts(video_path)
+                            scene = st.selectbox(
+                                f"Scene ({len(scenes)} found)",
+                                options=range(len(scenes)),
+                                format_func=lambda k: f"Scene {k + 1} · starts at {scenes[k]['timestamp']:.2f}s"
                             )
+                            frame_index = scenes[scene]['frame_index']
+                            frame_position = scenes[scene]['timestamp'] / video_info['duration'] if video_info['duration'] else 0.0
                         else:
-                            st.error("❌ Failed to extract thumbnail")
-            
-            # Clean up
-            try:
-                os.unlink(video_path)
-            except:
-                pass
+                            # Frame position selector
+                            frame_position = st.slider(
+                                "Select frame position to extract",
+                                min_value=0.0,
+                                max_value=1.0,
+                                value=0.5,
+                                step=0.05,
+                                help="0.0 = start, 0.5 = middle, 1.0 = end"
+                            )
+                        
+                        if preview_proxy:
+                            preview, preview_time = preview_frame(preview_proxy, frame_position * video_info['duration'])
+                            st.image(cv2.cvtColor(preview, cv2.COLOR_BGR2RGB),
+                                     caption=f"Preview · nearest keyframe at {preview_time:.2f}s", width=PREVIEW_WIDTH)
+                        elif preview_proxy is None:
+                            st.caption("⏳ Building a preview in the background...")
+                        else:
+                            st.caption("No preview for this video (too many keyframes for the preview cache, or they couldn't be decoded); Extract still works")
+                    
+                    if frame_position is not None and st.button("🖼️ Extract Thumbnail", type="primary"):
+                        with st.spinner("Extracting thumbnail..."):
+                            result = seek_frame(video_path, frame_position, seek_mode, frame_index, content_hash=video_hash)
+                            thumbnail = Image.fromarray(cv2.cvtColor(result['frame'], cv2.COLOR_BGR2RGB)) if result else None
+                            
+                            if thumbnail:
+                                st.success("✅ Thumbnail extracted!")
+                                st.image(thumbnail, caption=f"Extracted from {video_file.name}", width=400)
+                                keyframe_note = " (keyframe)" if result['keyframe'] else ""
+                                st.caption(f"Frame {result['frame_index']} at {result['timestamp']:.3f}s{keyframe_note}")
+                                cache_stats = get_frame_cache().stats()
+                                st.caption(f"Frame cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                                           f"{cache_stats['frames']} frames in {cache_stats['bytes'] / 2**20:.0f} of "
+                                           f"{cache_stats['max_bytes'] / 2**20:.0f} MiB")
+                                
+                                # Convert to bytes for download
+                                img_buffer = io.BytesIO()
+                                thumbnail.save(img_buffer, format='PNG')
+                                img_bytes = img_buffer.getvalue()
+                                
+                                # Download button
+                                filename = f"thumbnail_{video_file.name.split('.')[0]}.png"
+                                st.download_button(
+                                    label="💾 Download Thumbnail",
+                                    data=img_bytes,
+                                    file_name=filename,
+                                    mime="image/png"
+                                )
+                            else:
+                                st.error("❌ Failed to extract thumbnail")
     
     # Instructions
     st.subheader("📋 Instructions")
@@ -486,23 +4031,58 @@ def main():
         2. **Choose thumbnail mode**:
            - **Intro Screen**: Thumbnail shows for X seconds before video starts
            - **Overlay**: Thumbnail appears as watermark during video
+           - **Cover Art**: Thumbnail becomes the file's cover image in players and file browsers
         3. **Configure settings** for position, size, and duration
-        4. **Click "Create Video"** and wait for processing
+        4. **Click "Create Video"**: the video renders in the background, so you can start more renders or leave and come back to the same URL
         5. **Download your new video** with embedded thumbnail
         """)
+    elif mode == "Batch Processing":
+        st.markdown("""
+        1. **Upload your videos** or point to a directory on the server
+        2. **Upload one thumbnail** and choose the mode and settings
+        3. **Click "Process Batch"**: videos are rendered in parallel and results appear as each finishes
+        4. **Download each video**, or find them in the directory's `thumbnailed` folder
+        """)
+    elif mode == "Thumbnail Variants (A/B)":
+        st.markdown("""
+        1. **Upload one video and several thumbnails**
+        2. **Choose intro or overlay** and, for overlays, one or more positions
+        3. **Click "Render Variants"**: the video is decoded once for all variants
+        4. **Download each variant** for your A/B test
+        """)
     else:
         st.markdown("""
         1. **Upload a video file**
-        2. **Use the slider** to select which frame to extract
-        3. **Click "Extract Thumbnail"** to generate the image
-        4. **Download the thumbnail** as a PNG file
+        2. **Use the slider** (with a quick keyframe preview) or jump to a detected scene to select which frame to extract, choose **Multiple frames** for evenly spaced candidates, or let **Auto-pick best** find them
+        3. **Pick a seek mode**: Fast snaps to the nearest keyframe, Accurate returns the exact frame
+        4. **Click "Extract Thumbnail"** (or "Extract Frames") to generate the images
+        5. **Download the thumbnail** as a PNG file
         """)
     
     # Technical info
     with st.expander("🔧 Technical Details"):
         st.markdown("""
         - **Processing**: Uses OpenCV for video manipulation
-        - **Output Format**: MP4 with MPEG-4 codec
+        - **Output Format**: MP4 with MPEG-4 (OpenCV) or H.264 (ffmpeg pipe or PyAV, when installed) for full re-encodes
+        - **Stream Copy**: Intro mode encodes only the intro with the source's codec parameters and copies the original stream; encoded intros are cached for reuse
+        - **Cover Art**: Written as an MP4 attached picture; video and audio are remuxed without re-encoding
+        - **Overlay Blending**: Fixed-point premultiplied alpha, so transparent PNG thumbnails keep their transparency
+        - **Parallel Segments**: Full re-encodes can be split at keyframes and rendered across processes
+        - **Thumbnail Variants**: One decode feeds a compositor and encoder per variant running concurrently
+        - **Batch Processing**: Videos are spread over a process pool capped at the CPU count, with OpenCV threads split between workers
+        - **Smart Render**: Overlay mode re-encodes only up to the first keyframe after the overlay and stream-copies the rest with ffmpeg
+        - **Packet Index**: Every frame's timestamp, keyframe flag and byte offset, read from MP4/MOV sample tables (or one demux-only pass) and cached on disk; seeking, smart render cuts and overlay durations all count frames from it
+        - **Frame Extraction**: Seeks with a cached keyframe index, decoding one keyframe (Fast) or forward from the preceding keyframe (Accurate)
+        - **Multiple Frames**: One sorted pass that skips frames with grab() or seeks to the target's keyframe, whichever decodes less
+        - **Scrub Preview**: Keyframes are decoded once at low resolution into a memory-mapped proxy in the background; only Extract decodes at full resolution
+        - **Video Info**: Read from MP4/MOV boxes or Matroska headers (or ffprobe) without starting a decoder, memoized by content
+        - **Frame Cache**: Decoded frames are kept in a byte-bounded LRU keyed by video content and frame number, so revisiting a position is instant
+        - **Scene Detection**: One pass compares downscaled HSV histograms; scene starts are cached alongside the video info
+        - **Auto-pick**: Samples frames at low resolution and scores them in batches on sharpness, exposure, colorfulness and optionally faces
+        - **Duplicate Frames**: Perceptual hashes (pHash) in a Hamming-distance index collapse near-identical frames before scoring and display
+        - **Uploads**: Stored once per content hash in a store shared by all sessions, evicted least recently used but never while a run still uses them
+        - **Downloads**: Finished videos stay on disk; a local endpoint streams them with HTTP Range support (resumable), otherwise the file is read only when the download is clicked
+        - **Background Jobs**: Renders run on a server-side worker pool with job IDs kept in the URL; the page polls their frame progress and reattaches after a rerun or reload
         - **Compatibility**: Works on Streamlit Cloud with standard libraries
         - **Performance**: Processing time depends on video length and size
         - **Limitations**: Some advanced video codecs may not be supported
@@ -0,0 +1,166 @@
+"""
+Benchmarks for the video processing helpers in App.py
+
+Run ``python benchmarks.py`` for every benchmark or name the ones to run,
+e.g. ``python benchmarks.py blend``.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import App
+
+def bench_blend(width=1920, height=1080, size_ratio=0.2, number=200):
+    """Per-frame overlay cost of the fixed-point kernel against the old addWeighted path"""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    thumb_width = int(width * size_ratio)
+    thumb_height = thumb_width * 9 // 16
+    thumbnail = rng.integers(0, 256, (thumb_height, thumb_width, 4), dtype=np.uint8)
+    thumbnail[:, :, 3] = 255
+    x, y = width - thumb_width - 20, 20
+    alpha = 0.8
+
+    def add_weighted():
+        # The previous implementation: copy the frame, blend the ROI into a new array, copy it back
+        overlay_frame = frame.copy()
+        roi = overlay_frame[y:y+thumb_height, x:x+thumb_width]
+        blended = cv2.addWeighted(roi, 1-alpha, thumbnail[:, :, :3], alpha, 0)
+        overlay_frame[y:y+thumb_height, x:x+thumb_width] = blended
+
+    overlay = App.build_overlay(thumbnail, alpha)
+
+    def fixed_point():
+        App.blend_overlay(frame, overlay, x, y)
+
+    print(f"blend ({width}x{height}, {thumb_width}x{thumb_height} overlay)")
+    for name, func in [('addWeighted + frame copy', add_weighted), ('fixed-point in place', fixed_point)]:
+        seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print(f"  {name:<28} {seconds * 1e6:8.1f} µs/frame")
+
+def make_test_video(path, seconds, width, height, fps=30):
+    """Write a synthetic H.264 test video with ffmpeg"""
+    if not App.run_ffmpeg(['-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}', '-t', str(seconds),
+                           '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path]):
+        raise RuntimeError("ffmpeg is needed to generate the test video")
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def bench_memory(seconds=60, width=1280, height=720, samples=8):
+    """Memory over a long overlay render: RSS sampled throughout plus the tracemalloc peak"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        video_path = os.path.join(work_dir, 'input.mp4')
+        thumbnail_path = os.path.join(work_dir, 'thumbnail.png')
+        output_path = os.path.join(work_dir, 'output.mp4')
+        make_test_video(video_path, seconds, width, height)
+        cv2.imwrite(thumbnail_path, np.full((180, 320, 4), 200, np.uint8))
+
+        rss = []
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.05):
+                rss.append(current_rss())
+
+        sampler = threading.Thread(target=sample)
+        tracemalloc.start()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            # Keep the overlay on for the whole video so every frame is blended
+            App.add_thumbnail_overlay(video_path, thumbnail_path, output_path, duration_frames=seconds * 30)
+        finally:
+            elapsed = time.perf_counter() - start
+            done.set()
+            sampler.join()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    print(f"memory ({width}x{height}, {seconds}s overlaid, {elapsed:.1f}s to render)")
+    print(f"  tracemalloc peak {peak / 2**20:8.1f} MiB")
+    step = max(1, len(rss) // samples)
+    for k in range(0, len(rss), step):
+        print(f"  RSS at {k / len(rss):4.0%}   {rss[k] / 2**20:8.1f} MiB")
+    print(f"  RSS at end    {rss[-1] / 2**20:8.1f} MiB")
+
+def bench_encoders(seconds=20, width=1920, height=1080, preset='veryfast', crf=23):
+    """Encode fps and output size of each available encoder backend on the same overlay render"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        video_path = os.path.join(work_dir, 'input.mp4')
+        thumbnail_path = os.path.join(work_dir, 'thumbnail.png')
+        make_test_video(video_path, seconds, width, height)
+        cv2.imwrite(thumbnail_path, np.full((180, 320, 4), 200, np.uint8))
+
+        print(f"encoders ({width}x{height}, {seconds}s, preset {preset}, CRF {crf})")
+        for backend in App.available_encoders():
+            encoder = None if backend == 'opencv' else {'backend': backend, 'preset': preset, 'crf': crf}
+            output_path = os.path.join(work_dir, f'{backend}.mp4')
+            stats = {}
+            start = time.perf_counter()
+            App.add_thumbnail_overlay(video_path, thumbnail_path, output_path, duration_frames=seconds * 30,
+                                      stats=stats, encoder=encoder)
+            elapsed = time.perf_counter() - start
+            encode_fps = stats['frames'] / stats['encode']['busy'] if stats['encode']['busy'] else 0
+            print(f"  {backend:<8} {stats['frames'] / elapsed:7.1f} fps overall  {encode_fps:7.1f} fps encoding"
+                  f"  {os.path.getsize(output_path) / 2**20:8.2f} MiB")
+
+def bench_upload(size_mb=512):
+    """Peak extra memory and throughput of writing one upload to disk: whole read() against the chunked store copy"""
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+    data = np.random.default_rng(0).integers(0, 256, size_mb * 2**20, dtype=np.uint8).tobytes()
+    upload = UploadedFile(UploadedFileRec('bench', 'video.mp4', 'video/mp4', data), None)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        def read_and_write():
+            # The previous implementation: the whole upload as one bytes object, hashed separately
+            upload.seek(0)
+            with open(os.path.join(work_dir, 'whole.mp4'), 'wb') as f:
+                contents = upload.read()
+                f.write(contents)
+            App.hashlib.sha256(contents).hexdigest()
+
+        def chunked_store():
+            # A fresh store each run so every upload is a miss and really copied
+            store = App.UploadStore(os.path.join(work_dir, f'store_{time.perf_counter_ns()}'))
+            path, _ = store.acquire(upload)
+            store.release(path)
+
+        print(f"upload ({size_mb} MiB)")
+        for name, func in [('read() + write', read_and_write), ('chunked copy + hash', chunked_store)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {name:<22} peak {peak / 2**20:8.1f} MiB  {size_mb / elapsed:8.1f} MiB/s")
+
+BENCHMARKS = {
+    'blend': bench_blend,
+    'memory': bench_memory,
+    'encoders': bench_encoders,
+    'upload': bench_upload,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()